@@ -0,0 +1,125 @@
+import time
+script_start = time.perf_counter()
+
+import asyncio
+import signal
+from bleak import BleakClient
+from emg_processor import EMGProcessor
+from emg_pipeline import PacketQueue, decode_stage, feature_stage
+from emg_replay import ReplayClient
+from emg_stream import filtered_characteristic_uuid, sample_rate
+from emg_recording import SessionRecorder
+
+# Records and analyzes without any plotting: matplotlib and keyboard are never imported, and scipy
+# only once the first epoch is complete, so the connection is made as early as possible (the
+# firmware starts streaming three seconds after the connection).
+
+#BioAmp EXG Pill
+#device_address = 'f4:12:fa:63:47:29'
+
+#Myoware 2.0
+device_address = 'f4:12:fa:63:c2:2d'
+
+# Seconds to record, None records until stopped with Ctrl+C
+record_duration = None
+
+# Set to a received_floats.txt, egw1.csv or raw capture file to replay it instead of connecting to the device
+replay_source = None
+replay_speed = 1.0
+
+# Directory to stream the session to while recording, or None
+recording_path = None
+# Band-pass applied on the board (thesis_BioAmp.ino, generated with filter_gen.py)
+firmware_filter = {'type': 'bandpass', 'order': 4, 'band': [25.0, 380.0], 'rate': 800}
+
+# Algorithm B from the 'filter'ed LFC/HFC signals, or from the epoch 'spectrum' used for MNF/MPF (never imports scipy)
+fatigue_B_method = 'filter'
+
+class HeadlessRecorder:
+    def __init__(self, client, processor):
+        self.client = client
+        self.processor = processor
+        self.packet_queue = PacketQueue(maxsize=256)
+        self.data_ready = asyncio.Event()
+        self.stop_event = asyncio.Event()
+        self.connected_time = None
+
+    # Clean stop signal, safe to call from a signal handler scheduled on the loop
+    def stop(self):
+        self.stop_event.set()
+
+    async def run(self, duration=None):
+        await self.client.connect()
+        self.connected_time = time.perf_counter()
+        print(f"Connected to device with MAC address: {self.client.address}")
+        self.processor.preload_filters()
+
+        await self.client.start_notify(filtered_characteristic_uuid, self.packet_queue.push)
+        stages = asyncio.gather(decode_stage(self.packet_queue, self.processor.update_received_data, self.data_ready),
+                                feature_stage(self.processor.features_calculation, self.data_ready))
+        stop = asyncio.ensure_future(self.stop_event.wait())
+        try:
+            # Runs until stopped or the duration is up, unless a stage fails first
+            done, pending = await asyncio.wait({stop, stages}, timeout=duration, return_when=asyncio.FIRST_COMPLETED)
+            if stages in done:
+                stages.result()
+        finally:
+            stop.cancel()
+            if not stages.done():
+                stages.cancel()
+                try:
+                    await stages
+                except asyncio.CancelledError:
+                    pass
+            await self.client.disconnect()
+
+    def report(self):
+        if self.connected_time is not None:
+            print(f"Time to connect: {self.connected_time - script_start:.3f} s")
+        if self.processor.first_sample_time is not None:
+            print(f"Time to first sample: {self.processor.first_sample_time - script_start:.3f} s "
+                  f"({self.processor.first_sample_time - self.connected_time:.3f} s after connecting)")
+        else:
+            print("No samples received.")
+        stats = self.packet_queue.stats()
+        print(f"Samples: {self.processor.sample_count}, epochs: {self.processor.rms_values.total}, "
+              f"packets received: {stats['received_packets']}, dropped: {stats['dropped_packets']}, "
+              f"high-water mark: {stats['high_water_mark']}")
+        print(f"Max epoch lag: {self.processor.max_epoch_lag}, skipped epochs: {self.processor.skipped_epochs}")
+        slope, (slope_low, slope_high), r_squared = self.processor.slope_confidence()
+        print(f"MNF slope: {slope:.4f} Hz/s (95% CI {slope_low:.4f} to {slope_high:.4f}, R^2 {r_squared:.2f})")
+
+
+def install_stop_handler(recorder):
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGINT, recorder.stop)
+    except NotImplementedError:
+        # Windows event loops have no add_signal_handler
+        signal.signal(signal.SIGINT, lambda signum, frame: loop.call_soon_threadsafe(recorder.stop))
+
+async def main():
+    if replay_source is not None:
+        client = ReplayClient.from_file(replay_source, speed=replay_speed)
+    else:
+        client = BleakClient(device_address)
+    session_recorder = None
+    if recording_path is not None:
+        session_recorder = SessionRecorder(recording_path, sample_rate=sample_rate, device=device_address, filter_config=firmware_filter,
+                                           fatigue_B_method=fatigue_B_method)
+    processor = EMGProcessor(recorder=session_recorder, fatigue_B_method=fatigue_B_method)
+    recorder = HeadlessRecorder(client, processor)
+    install_stop_handler(recorder)
+
+    try:
+        await recorder.run(duration=record_duration)
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+    finally:
+        processor.save_csv()
+        processor.close()
+        recorder.report()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
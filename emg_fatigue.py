@@ -0,0 +1,81 @@
+import numpy as np
+from emg_features import StreamingFilterBank, band_fatigue_index, get_spectral_plan, spectral_fatigue_B_index
+
+# Batch versions of the live fatigue algorithms (EMGProcessor.algorithm_A_fatigue and
+# algorithm_B_fatigue): they take the per-epoch feature history of a whole session and return the
+# complete fatigue series in one call, with the same values the live loop produced. Each returns
+# (epoch index at which a value was produced, values).
+#
+# The defaults reproduce the live algorithms; the thresholds are parameters so archived sessions
+# can be re-scored with different ones (see replay_fatigue).
+
+
+# Algorithm A: every group_size epochs from epoch first_epoch on, the mean MPF of the group_size
+# epochs before it is compared with a baseline that starts as the mean of the first group_size
+# epochs and ratchets up to any higher group mean
+def batch_fatigue_A(mpf_values, group_size=5, first_epoch=10):
+    if group_size < 1 or first_epoch < group_size:
+        raise ValueError(f"Need group_size >= 1 and first_epoch >= group_size, got {group_size} and {first_epoch}")
+    mpf_values = np.asarray(mpf_values, dtype=np.float64)
+    epochs = np.arange(first_epoch, len(mpf_values), group_size)
+    if len(epochs) == 0:
+        return epochs, np.empty(0)
+
+    averages = mpf_values[first_epoch - group_size:epochs[-1]].reshape(-1, group_size).mean(axis=1)
+    baseline = np.mean(mpf_values[0:group_size])
+    baselines = np.maximum.accumulate(np.concatenate(([baseline], averages)))[1:]
+    return epochs, ((baselines - averages) / baselines) * 100
+
+# Algorithm B: for every epoch whose IEMG exceeds trigger_ratio times the first epoch's, the
+# LFC/HFC spectral amplitude difference of that epoch. method='filter' band-passes the whole signal
+# with the same causal filter bank as the live stream, 'spectrum' uses the epoch spectrum (see
+# EMGProcessor's fatigue_B_method).
+def batch_fatigue_B(iemg_values, start_samples, signal, fs=800, epoch_length=800, method='filter', trigger_ratio=1.0):
+    iemg_values = np.asarray(iemg_values, dtype=np.float64)
+    if len(iemg_values) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    epochs = np.flatnonzero(iemg_values > iemg_values[0] * trigger_ratio)
+    starts = np.asarray(start_samples)[epochs]
+    if len(epochs) == 0:
+        return epochs, np.empty(0)
+
+    if method == 'filter':
+        lfc, hfc = StreamingFilterBank(fs=float(fs)).process(signal)
+        lfc_epochs = np.lib.stride_tricks.sliding_window_view(lfc, epoch_length)[starts]
+        hfc_epochs = np.lib.stride_tricks.sliding_window_view(hfc, epoch_length)[starts]
+        return epochs, band_fatigue_index(lfc_epochs, hfc_epochs, fs=fs)
+    if method == 'spectrum':
+        signal = np.asarray(signal, dtype=np.float64)
+        plan = get_spectral_plan(epoch_length, fs)
+        signal_epochs = np.lib.stride_tricks.sliding_window_view(signal, epoch_length)[starts]
+        return epochs, spectral_fatigue_B_index(np.abs(plan.spectrum(signal_epochs)), plan)
+    raise ValueError(f"Unknown fatigue B method: {method}")
+
+# Both algorithms over a session loaded with emg_recording.load_session(). fs and method default to
+# the ones the session was recorded with (from its header).
+def replay_fatigue(session, fs=None, method=None, trigger_ratio=1.0, group_size=5, first_epoch=10):
+    header = session['header']
+    if fs is None:
+        # Version 1 headers did not store the rate the pipeline ran at
+        fs = header['sample_rate'] if header.get('format_version', 1) >= 2 else 800
+    if method is None:
+        method = header.get('fatigue_B_method') or 'filter'
+    epochs = session['epochs']
+    fatigue_A_epochs, fatigue_A = batch_fatigue_A(epochs['mpf'], group_size=group_size, first_epoch=first_epoch)
+    fatigue_B_epochs, fatigue_B = batch_fatigue_B(epochs['iemg'], epochs['start_sample'], session['samples'], fs=fs,
+                                                  method=method, trigger_ratio=trigger_ratio)
+    return {
+        'fatigue_A_epochs': fatigue_A_epochs,
+        'fatigue_A': fatigue_A,
+        'fatigue_B_epochs': fatigue_B_epochs,
+        'fatigue_B': fatigue_B,
+    }
+
+
+if __name__ == '__main__':
+    import sys
+    from emg_recording import load_session
+    for path in sys.argv[1:]:
+        result = replay_fatigue(load_session(path))
+        print(f"{path}: {len(result['fatigue_A'])} fatigue A values (last {result['fatigue_A'][-1:]}), "
+              f"{len(result['fatigue_B'])} fatigue B values (last {result['fatigue_B'][-1:]})")
@@ -0,0 +1,494 @@
+import numpy as np
+from emg_stream import RingBuffer
+
+# Per-epoch EMG features. These are plain functions of the epoch data so they can run on a
+# worker thread or process as well as on the event loop.
+
+def calculate_rms(rms_val):
+    return np.sqrt(np.mean(np.square(rms_val)))
+
+def calculate_iemg(iemg_values):
+    return np.sum(np.abs(iemg_values))
+
+def mnf_from_power(freq_values, power_spectrum):
+    return np.sum(freq_values * power_spectrum) / np.sum(power_spectrum)
+
+def mpf_from_power(freq_values, power_spectrum):
+    total_power = np.sum(power_spectrum)
+    cumulative_power = np.cumsum(power_spectrum)
+    mpf_index = np.argmax(cumulative_power >= 0.5 * total_power)
+    return freq_values[mpf_index]
+
+def calculate_mnf(freq_values, fft_result):
+    return mnf_from_power(freq_values, np.abs(fft_result)**2)
+
+def calculate_mpf(freq_values, fft_result):
+    return mpf_from_power(freq_values, np.abs(fft_result)**2)
+
+
+# Smallest 5-smooth number (2^a 3^b 5^c) >= n: lengths the FFT handles fastest
+def next_fast_length(n):
+    best = None
+    power5 = 1
+    while power5 < 2 * n:
+        power35 = power5
+        while power35 < 2 * n:
+            length = power35
+            while length < n:
+                length *= 2
+            if best is None or length < best:
+                best = length
+            power35 *= 3
+        power5 *= 5
+    return best
+
+# Everything about an epoch's spectrum that only depends on (epoch length, sample rate, window):
+# frequency bins, window coefficients and band masks. A real FFT is used, and only the
+# non-negative frequency bins of the full FFT are kept (0 .. fs/2 excluding Nyquist for even
+# lengths), so results match the original np.fft.fft + (freq >= 0) mask.
+# pad_to_fast zero-pads to next_fast_length(), which changes the bin spacing; 800 already is one.
+class SpectralPlan:
+    windows = {'hann': np.hanning, 'hamming': np.hamming, 'blackman': np.blackman}
+
+    def __init__(self, length, fs=800, window=None, pad_to_fast=False):
+        self.length = length
+        self.fs = fs
+        self.window_name = window
+        self.window = None if window is None else self.windows[window](length)
+        self.n_fft = next_fast_length(length) if pad_to_fast else length
+        self.num_positive = (self.n_fft + 1) // 2
+        self.positive_freq_values = np.fft.rfftfreq(self.n_fft, d=1/fs)[:self.num_positive]
+        # Weights that turn a sum over the positive bins into a sum over the full two-sided spectrum
+        self.full_spectrum_weights = np.full(self.n_fft // 2 + 1, 2.0)
+        self.full_spectrum_weights[0] = 1.0
+        if self.n_fft % 2 == 0:
+            self.full_spectrum_weights[-1] = 1.0
+        self.band_masks = {}
+
+    # Non-negative frequency bins of one epoch, or of every row of a 2-D array of epochs
+    def spectrum(self, epoch_data):
+        return self.rfft(epoch_data)[..., :self.num_positive]
+
+    def rfft(self, epoch_data):
+        if self.window is not None:
+            epoch_data = epoch_data * self.window
+        return np.fft.rfft(epoch_data, n=self.n_fft, axis=-1)
+
+    # sum(|X|) over all bins of the two-sided FFT, from the one-sided rfft output (per row for 2-D input;
+    # a row gives the same result whether it is reduced alone or in a batch)
+    def full_abs_sum(self, rfft_result):
+        return np.sum(np.abs(rfft_result) * self.full_spectrum_weights, axis=-1)
+
+    def band_mask(self, low, high):
+        mask = self.band_masks.get((low, high))
+        if mask is None:
+            mask = (self.positive_freq_values >= low) & (self.positive_freq_values <= high)
+            self.band_masks[(low, high)] = mask
+        return mask
+
+spectral_plans = {}
+
+def get_spectral_plan(length, fs=800, window=None, pad_to_fast=False):
+    key = (length, fs, window, pad_to_fast)
+    plan = spectral_plans.get(key)
+    if plan is None:
+        plan = SpectralPlan(length, fs=fs, window=window, pad_to_fast=pad_to_fast)
+        spectral_plans[key] = plan
+    return plan
+
+
+# MNF and MPF of one epoch. If fatigue_segment is given, the algorithm B fatigue index of that
+# segment is computed as well so the caller does not have to do it inline; with
+# fatigue_B_from_spectrum it is taken from this epoch's spectrum instead (spectral_fatigue_B_index),
+# and with fatigue_bands, the epoch's (lfc, hfc) from a streamed filter bank, from those bands.
+# EMGProcessor takes RMS and IEMG from its running window sums (SlidingWindowSums).
+def spectral_features(epoch_data, fs=800, fatigue_segment=None, fatigue_B_from_spectrum=False, fatigue_bands=None):
+    plan = get_spectral_plan(len(epoch_data), fs)
+    amplitude_spectrum = np.abs(plan.spectrum(epoch_data))
+    power_spectrum = amplitude_spectrum**2
+    features = {
+        'mnf': mnf_from_power(plan.positive_freq_values, power_spectrum),
+        'mpf': mpf_from_power(plan.positive_freq_values, power_spectrum),
+    }
+
+    if fatigue_B_from_spectrum:
+        features['fatigue_B'] = spectral_fatigue_B_index(amplitude_spectrum, plan)
+    elif fatigue_bands is not None:
+        features['fatigue_B'] = band_fatigue_index(*fatigue_bands, fs=fs)
+    elif fatigue_segment is not None:
+        features['fatigue_B'] = fatigue_B_index(fatigue_segment, fs=fs)
+    return features
+
+# RMS, IEMG, MNF and MPF of one epoch
+def epoch_features(epoch_data, fs=800, fatigue_segment=None):
+    features = {
+        'rms': calculate_rms(epoch_data),
+        'iemg': calculate_iemg(epoch_data),
+    }
+    features.update(spectral_features(epoch_data, fs=fs, fatigue_segment=fatigue_segment))
+    return features
+
+
+# MNF and MPF of every row of a (num_epochs, epoch_length) array, through one batched FFT, plus
+# the spectral algorithm B index of every epoch with fatigue_B_from_spectrum
+def batch_spectral_features(epochs, fs=800, fatigue_B_from_spectrum=False):
+    plan = get_spectral_plan(epochs.shape[1], fs)
+    positive_freq_values = plan.positive_freq_values
+    amplitude_spectrum = np.abs(plan.spectrum(epochs))
+    power_spectrum = amplitude_spectrum**2
+    total_power = np.sum(power_spectrum, axis=1)
+    cumulative_power = np.cumsum(power_spectrum, axis=1)
+    mpf_index = np.argmax(cumulative_power >= 0.5 * total_power[:, None], axis=1)
+    features = {
+        'mnf': np.sum(positive_freq_values * power_spectrum, axis=1) / total_power,
+        'mpf': positive_freq_values[mpf_index],
+    }
+    if fatigue_B_from_spectrum:
+        features['fatigue_B'] = spectral_fatigue_B_index(amplitude_spectrum, plan)
+    return features
+
+
+# Same features as epoch_features for every epoch of a whole recording at once. The epochs are
+# strided views of the signal (no copy) of epoch_length samples every step samples; each chunk of
+# epochs goes through one batched FFT and vectorized reductions. Epoch i starts at sample i * step,
+# and each value matches epoch_features on that epoch.
+def batch_epoch_features(signal, epoch_length=800, step=400, fs=800, chunk_epochs=2048):
+    signal = np.asarray(signal, dtype=np.float64)
+    if len(signal) < epoch_length:
+        num_epochs = 0
+    else:
+        num_epochs = (len(signal) - epoch_length) // step + 1
+    features = {name: np.empty(num_epochs) for name in ('rms', 'iemg', 'mnf', 'mpf')}
+    features['start_sample'] = np.arange(num_epochs) * step
+    if num_epochs == 0:
+        return features
+
+    epochs = np.lib.stride_tricks.sliding_window_view(signal, epoch_length)[::step][:num_epochs]
+
+    # Chunks bound the size of the spectra held in memory for long recordings
+    for start in range(0, num_epochs, chunk_epochs):
+        chunk = epochs[start:start + chunk_epochs]
+        end = start + len(chunk)
+        features['rms'][start:end] = np.sqrt(np.mean(np.square(chunk), axis=1))
+        features['iemg'][start:end] = np.sum(np.abs(chunk), axis=1)
+        for name, values in batch_spectral_features(chunk, fs=fs).items():
+            features[name][start:end] = values
+    return features
+
+
+# Time-domain feature bank of one epoch, or of every row of a 2-D array of epochs, in one pass:
+# the absolute values and the first differences are computed once and every feature is a reduction
+# of them.
+#
+#   mav    mean absolute value           iemg   sum of |x|
+#   rms    root mean square              wl     waveform length, sum of |x[i+1] - x[i]|
+#   zc     zero crossings: sign changes with |x[i+1] - x[i]| >= zc_threshold
+#   ssc    slope sign changes: (x[i] - x[i-1]) * (x[i] - x[i+1]) > ssc_threshold
+#   wamp   Willison amplitude: steps with |x[i+1] - x[i]| > wamp_threshold
+#
+# Thresholds are in signal units; 0 counts every sign change, a value just above the sensor noise
+# keeps noise from being counted. rms and iemg match calculate_rms/calculate_iemg.
+def time_domain_features(epochs, zc_threshold=0.0, ssc_threshold=0.0, wamp_threshold=0.0):
+    epochs = np.asarray(epochs, dtype=np.float64)
+    absolute = np.abs(epochs)
+    differences = np.diff(epochs, axis=-1)
+    absolute_differences = np.abs(differences)
+    iemg = np.sum(absolute, axis=-1)
+    return {
+        'rms': np.sqrt(np.mean(np.square(epochs), axis=-1)),
+        'iemg': iemg,
+        'mav': iemg / epochs.shape[-1],
+        'wl': np.sum(absolute_differences, axis=-1),
+        'zc': np.count_nonzero((epochs[..., :-1] * epochs[..., 1:] < 0)
+                               & (absolute_differences >= zc_threshold), axis=-1),
+        'ssc': np.count_nonzero(-(differences[..., :-1] * differences[..., 1:]) > ssc_threshold, axis=-1),
+        'wamp': np.count_nonzero(absolute_differences > wamp_threshold, axis=-1),
+    }
+
+# Every time-domain feature plus MNF, MPF and the median frequency (mdf) of one epoch or of every
+# row of a 2-D array of epochs. MPF here is the median power frequency (the bin where the cumulative
+# power reaches half), so mdf is the same values under the name the literature uses.
+def feature_bank(epochs, fs=800, zc_threshold=0.0, ssc_threshold=0.0, wamp_threshold=0.0):
+    features = time_domain_features(epochs, zc_threshold=zc_threshold, ssc_threshold=ssc_threshold,
+                                    wamp_threshold=wamp_threshold)
+    if np.ndim(epochs) == 1:
+        features.update(spectral_features(np.asarray(epochs, dtype=np.float64), fs=fs))
+    else:
+        features.update(batch_spectral_features(np.asarray(epochs, dtype=np.float64), fs=fs))
+    features['mdf'] = features['mpf']
+    return features
+
+# feature_bank for every epoch of a whole recording, epochs as in batch_epoch_features
+def batch_feature_bank(signal, epoch_length=800, step=400, fs=800, chunk_epochs=2048, **thresholds):
+    signal = np.asarray(signal, dtype=np.float64)
+    if len(signal) < epoch_length:
+        epochs = np.empty((0, epoch_length))
+    else:
+        epochs = np.lib.stride_tricks.sliding_window_view(signal, epoch_length)[::step]
+
+    # Chunks bound the size of the intermediate arrays held in memory for long recordings
+    chunks = [feature_bank(epochs[start:start + chunk_epochs], fs=fs, **thresholds)
+              for start in range(0, max(len(epochs), 1), chunk_epochs)]
+    features = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0] if name != 'mdf'}
+    features['mdf'] = features['mpf']
+    features['start_sample'] = np.arange(len(epochs)) * step
+    return features
+
+
+# Sliding DFT: the non-negative bins of the DFT of the last `length` samples, updated for every new
+# sample in O(bins) instead of one FFT per epoch:
+#
+#   X_k(n) = (X_k(n-1) - x(n-length) + x(n)) * exp(2j*pi*k/length)
+#
+# A block is applied in one vectorized step (twiddle factors come from an exact phase table, so no
+# powers are accumulated). process() returns MNF and MPF of the window ending at every
+# output_step-th sample once the first window is full; with output_step=400 those are exactly the
+# epochs. The bins are re-computed with a real FFT every resync_interval samples so that rounding
+# errors of the recursion cannot build up.
+class SlidingDFT:
+    def __init__(self, length=800, fs=800, output_step=1, resync_interval=8000, max_block=1024):
+        self.length = length
+        self.output_step = output_step
+        self.resync_interval = resync_interval
+        self.max_block = max_block
+        self.plan = get_spectral_plan(length, fs)
+        self.bins = np.arange(self.plan.num_positive)
+        self.phase_table = np.exp(-2j * np.pi * np.arange(length) / length)
+        self.reset()
+
+    # Returns (sample index of the last sample of each output window, mnf, mpf)
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        results = [self.process_chunk(block[i:i + self.max_block]) for i in range(0, len(block), self.max_block)]
+        if not results:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+        return tuple(np.concatenate(values) for values in zip(*results))
+
+    def process_chunk(self, block):
+        num_samples = len(block)
+        in_window = self.samples.latest(self.length)
+        if num_samples <= self.length:
+            leaving = in_window[:num_samples]
+        else:
+            leaving = np.concatenate((in_window, block[:num_samples - self.length]))
+        steps = np.arange(num_samples)
+
+        # After sample i: X = W^(i+1) * (X_0 + sum_{l<=i} (x_new_l - x_old_l) * W^-l), with W^-l = phase_table[k*l mod length]
+        sample_indices = self.count + steps
+        outputs = steps[(sample_indices >= self.length - 1) & ((sample_indices - (self.length - 1)) % self.output_step == 0)]
+        needed = np.append(outputs, num_samples - 1)
+        rotated = (block - leaving)[:, None] * self.phase_table[np.outer(steps, self.bins) % self.length]
+        accumulated = self.spectrum + np.cumsum(rotated, axis=0)[needed]
+        spectra = accumulated * self.phase_table[(-np.outer(needed + 1, self.bins)) % self.length]
+
+        self.spectrum = spectra[-1]
+        self.samples.extend(block)
+        self.count += num_samples
+        self.samples_since_resync += num_samples
+        if self.samples_since_resync >= self.resync_interval:
+            self.resync()
+
+        power_spectrum = np.abs(spectra[:-1])**2
+        freq_values = self.plan.positive_freq_values
+        total_power = np.sum(power_spectrum, axis=1)
+        cumulative_power = np.cumsum(power_spectrum, axis=1)
+        mpf_index = np.argmax(cumulative_power >= 0.5 * total_power[:, None], axis=1)
+        return (self.count - num_samples + outputs, np.sum(freq_values * power_spectrum, axis=1) / total_power,
+                freq_values[mpf_index])
+
+    # Exact bins of the current window
+    def resync(self):
+        self.spectrum = self.plan.spectrum(self.samples.latest(self.length))
+        self.samples_since_resync = 0
+
+    def reset(self):
+        # Starts from a window of zeros
+        self.samples = RingBuffer(self.length, dtype=np.float64)
+        self.samples.extend(np.zeros(self.length))
+        self.spectrum = np.zeros(self.plan.num_positive, dtype=complex)
+        self.count = 0
+        self.samples_since_resync = 0
+
+
+# Short-time Fourier transform of a stream for the live spectrogram: one column of power in dB per
+# hop, over a Hann-windowed frame of `length` samples. Samples are fed in blocks of any size; the
+# ones not yet covered by a whole frame are carried to the next call.
+class StreamingSTFT:
+    def __init__(self, length=256, hop=64, fs=800, window='hann'):
+        self.length = length
+        self.hop = hop
+        self.plan = get_spectral_plan(length, fs, window=window)
+        self.num_bins = self.plan.num_positive
+        self.reset()
+
+    # (num_columns, num_bins) array of the columns completed by this block
+    def process(self, block):
+        samples = np.concatenate((self.tail, np.asarray(block, dtype=np.float64)))
+        self.count += len(block)
+        if len(samples) < self.length:
+            self.tail = samples
+            return np.empty((0, self.num_bins))
+        num_columns = (len(samples) - self.length) // self.hop + 1
+        frames = np.lib.stride_tricks.sliding_window_view(samples, self.length)[::self.hop][:num_columns]
+        self.tail = samples[num_columns * self.hop:]
+        power_spectrum = np.abs(self.plan.spectrum(frames))**2
+        return 10 * np.log10(power_spectrum + 1e-12)
+
+    def reset(self):
+        self.tail = np.empty(0)
+        self.count = 0
+
+
+# Algorithm B bands: Low Frequency Component (LFC) and High Frequency Component (HFC)
+fatigue_B_bands = [(25.0, 79.0), (80.0, 350.0)]
+
+butterworth_designs = {}
+
+# Second-order sections of a Butterworth band-pass, designed once per (band, fs, order)
+def butterworth_bandpass_sos(lowcut, highcut, fs=800.0, order=4):
+    key = (lowcut, highcut, float(fs), order)
+    sos = butterworth_designs.get(key)
+    if sos is None:
+        # scipy is only imported once a filter is first needed, it is slow to load
+        from scipy.signal import butter
+        nyquist = 0.5 * fs
+        sos = butter(order, [lowcut / nyquist, highcut / nyquist], btype='band', output='sos')
+        butterworth_designs[key] = sos
+    return sos
+
+# Zero-phase (filtfilt) LFC and HFC of a whole signal
+def butterworth_bandpass_filter(signal, fs=800.0):
+    from scipy.signal import sosfiltfilt
+    return tuple(sosfiltfilt(butterworth_bandpass_sos(lowcut, highcut, fs=fs), signal) for lowcut, highcut in fatigue_B_bands)
+
+# Causal band-pass filter bank for the live stream. The filter state (zi) of every band is
+# carried from one block to the next, so each sample is filtered exactly once and filtering a
+# signal block by block gives the same output as filtering it in one go.
+class StreamingFilterBank:
+    def __init__(self, bands=fatigue_B_bands, fs=800.0, order=4):
+        from scipy.signal import sosfilt
+        self.sosfilt = sosfilt
+        self.bands = bands
+        self.sos = [butterworth_bandpass_sos(lowcut, highcut, fs=fs, order=order) for lowcut, highcut in bands]
+        self.reset()
+
+    # One filtered block per band
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        outputs = []
+        for i, sos in enumerate(self.sos):
+            filtered, self.zi[i] = self.sosfilt(sos, block, zi=self.zi[i])
+            outputs.append(filtered)
+        return outputs
+
+    def reset(self):
+        self.zi = [np.zeros((sos.shape[0], 2)) for sos in self.sos]
+
+# Algorithm B fatigue index of already band-passed signals (or of every row of 2-D arrays of
+# epochs): mean spectral amplitude of the LFC minus that of the HFC
+def band_fatigue_index(lfc, hfc, fs=800):
+    # Step 2: Calculate FFT of the Low Frequency Component (LFC) and High Frequency Component (HFC),
+    # one real FFT each through the cached plan
+    plan = get_spectral_plan(np.shape(lfc)[-1], fs)
+    fft_lfc = plan.rfft(lfc)
+    fft_hfc = plan.rfft(hfc)
+
+    # Step 3: Calculate Instantaneous Mean Amplitude of LFC and HFC
+    # (sum over the full two-sided spectrum, divided by the number of non-negative bins)
+    ima_lfc = plan.full_abs_sum(fft_lfc) / plan.num_positive
+    ima_hfc = plan.full_abs_sum(fft_hfc) / plan.num_positive
+
+    # Step 4: Calculate Fatigue Index
+    return ima_lfc - ima_hfc
+
+# Algorithm B fatigue index straight from the amplitude spectrum of the epoch (one row per epoch)
+# that MNF/MPF are computed from: each band's mean amplitude is a masked sum over its bins instead
+# of filtering the signal and taking another FFT. The band edges are ideal rather than Butterworth
+# skirts, otherwise it is the same normalization as band_fatigue_index (every positive bin in a
+# band stands for two bins of the two-sided spectrum).
+def spectral_fatigue_B_index(amplitude_spectrum, plan, bands=fatigue_B_bands):
+    (lfc_low, lfc_high), (hfc_low, hfc_high) = bands
+    ima_lfc = 2 * band_sum(amplitude_spectrum, plan.band_mask(lfc_low, lfc_high)) / plan.num_positive
+    ima_hfc = 2 * band_sum(amplitude_spectrum, plan.band_mask(hfc_low, hfc_high)) / plan.num_positive
+    return ima_lfc - ima_hfc
+
+# Sum over the masked bins of each row. The selection is made contiguous so a row is summed in the
+# same order whether it comes alone or in a batch (masked 2-D selections can come out column-major).
+def band_sum(spectrum, mask):
+    return np.sum(np.ascontiguousarray(spectrum[..., mask]), axis=-1)
+
+# Algorithm B fatigue index of a raw signal, band-passed with zero-phase filtering
+def fatigue_B_index(signal, fs=800):
+    lfc, hfc = butterworth_bandpass_filter(signal, fs=float(fs))
+    return band_fatigue_index(lfc, hfc, fs=fs)
+
+
+# Online least-squares line through (x, y) points, e.g. MNF against time, updated in O(1) per point
+# from running weighted means and co-moments (numerically stable, no sums of large squares).
+# decay < 1 turns it into an exponentially weighted regression: every update multiplies the weight
+# of the earlier points by decay, so the fit follows the recent trend.
+class OnlineRegression:
+    def __init__(self, decay=1.0):
+        self.decay = decay
+        self.reset()
+
+    def update(self, x, y):
+        self.count += 1
+        self.weight = self.decay * self.weight + 1.0
+        self.weight_squares = self.decay**2 * self.weight_squares + 1.0
+        dx = x - self.mean_x
+        dy = y - self.mean_y
+        self.mean_x += dx / self.weight
+        self.mean_y += dy / self.weight
+        self.cxx = self.decay * self.cxx + dx * (x - self.mean_x)
+        self.cxy = self.decay * self.cxy + dx * (y - self.mean_y)
+        self.cyy = self.decay * self.cyy + dy * (y - self.mean_y)
+
+    def slope(self):
+        return self.cxy / self.cxx if self.cxx > 0 else np.nan
+
+    def intercept(self):
+        return self.mean_y - self.slope() * self.mean_x
+
+    def predict(self, x):
+        return self.mean_y + self.slope() * (x - self.mean_x)
+
+    # Number of points the weights are worth (the count for decay = 1)
+    def effective_count(self):
+        return self.weight**2 / self.weight_squares if self.weight_squares > 0 else 0.0
+
+    # Standard error of the slope (weights normalized to the effective number of points)
+    def slope_stderr(self):
+        num_points = self.effective_count()
+        if self.cxx <= 0 or num_points <= 2:
+            return np.nan
+        residual_sum_squares = max(self.cyy - self.cxy**2 / self.cxx, 0.0)
+        return np.sqrt(residual_sum_squares / (num_points - 2) / self.cxx)
+
+    # Normal-approximation confidence interval of the slope (z = 1.96 for 95 %)
+    def confidence_interval(self, z=1.96):
+        slope = self.slope()
+        margin = z * self.slope_stderr()
+        return slope - margin, slope + margin
+
+    # Fraction of the variance of y explained by the line
+    def r_squared(self):
+        if self.cxx <= 0 or self.cyy <= 0:
+            return np.nan
+        return self.cxy**2 / (self.cxx * self.cyy)
+
+    def reset(self):
+        self.count = 0
+        self.weight = 0.0
+        self.weight_squares = 0.0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.cxx = 0.0
+        self.cxy = 0.0
+        self.cyy = 0.0
+
+# Fatigue index of a frequency trend: percent of the fitted starting frequency lost per minute
+# (positive while MNF/MPF is falling), from a regression of frequency against time in seconds
+def slope_fatigue_index(regression, start_time=0.0):
+    start_value = regression.predict(start_time)
+    return -100 * 60 * regression.slope() / start_value
@@ -0,0 +1,106 @@
+import threading
+import time
+import numpy as np
+from emg_stream import sample_dtype
+
+# Logging sink that batches decoded blocks in memory and writes them from a background thread,
+# so the event loop never opens, formats or flushes files. Batches are written once
+# max_buffer_bytes are pending or flush_interval seconds have passed, whichever comes first.
+#
+# fmt='text' writes one line of ', '-separated values per block (the received_floats.txt format),
+# fmt='binary' appends the raw little-endian values.
+class BackgroundWriter:
+    def __init__(self, path, fmt='binary', dtype=sample_dtype, mode=None, max_buffer_bytes=64 * 1024, flush_interval=1.0):
+        if fmt not in ('text', 'binary'):
+            raise ValueError(f"Unknown log format: {fmt}")
+        self.path = path
+        self.fmt = fmt
+        self.dtype = np.dtype(dtype)
+        self.max_buffer_bytes = max_buffer_bytes
+        self.flush_interval = flush_interval
+        if mode is None:
+            mode = 'a' if fmt == 'text' else 'ab'
+        self.file = open(path, mode)
+
+        self.condition = threading.Condition()
+        self.pending = []
+        self.pending_bytes = 0
+        self.oldest_pending_time = None
+        self.closing = False
+
+        # Counters, see stats()
+        self.start_time = time.monotonic()
+        self.blocks_written = 0
+        self.bytes_written = 0
+        self.flushes = 0
+        self.total_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+        self.thread = threading.Thread(target=self.run, name=f'writer:{path}', daemon=True)
+        self.thread.start()
+
+    # Queue a block of values (copied, so views into reused buffers are safe to pass)
+    def write(self, block):
+        block = np.array(block, dtype=self.dtype)
+        with self.condition:
+            if self.closing:
+                raise ValueError(f"{self.path} is closed")
+            if self.oldest_pending_time is None:
+                self.oldest_pending_time = time.monotonic()
+            self.pending.append(block)
+            self.pending_bytes += block.nbytes
+            if self.pending_bytes >= self.max_buffer_bytes:
+                self.condition.notify()
+
+    def format(self, blocks):
+        if self.fmt == 'text':
+            return ''.join(', '.join(map(str, block.tolist())) + '\n' for block in blocks)
+        return b''.join(block.tobytes() for block in blocks)
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.closing or self.pending_bytes >= self.max_buffer_bytes,
+                                        timeout=self.flush_interval)
+                blocks = self.pending
+                oldest_pending_time = self.oldest_pending_time
+                self.pending = []
+                self.pending_bytes = 0
+                self.oldest_pending_time = None
+                closing = self.closing
+
+            if blocks:
+                data = self.format(blocks)
+                self.file.write(data)
+                self.file.flush()
+                # Latency from the oldest block being queued to it being handed to the OS
+                latency = time.monotonic() - oldest_pending_time
+                self.blocks_written += len(blocks)
+                self.bytes_written += sum(block.nbytes for block in blocks) if self.fmt == 'binary' else len(data)
+                self.flushes += 1
+                self.total_flush_latency += latency
+                self.max_flush_latency = max(self.max_flush_latency, latency)
+            if closing:
+                return
+
+    def stats(self):
+        elapsed = time.monotonic() - self.start_time
+        return {
+            'blocks_written': self.blocks_written,
+            'bytes_written': self.bytes_written,
+            'bytes_per_sec': self.bytes_written / elapsed if elapsed > 0 else 0.0,
+            'flushes': self.flushes,
+            'mean_flush_latency': self.total_flush_latency / self.flushes if self.flushes else 0.0,
+            'max_flush_latency': self.max_flush_latency,
+            'pending_bytes': self.pending_bytes,
+        }
+
+    # Writes whatever is still pending and closes the file
+    def close(self):
+        with self.condition:
+            if self.closing:
+                return
+            self.closing = True
+            self.condition.notify()
+        self.thread.join()
+        self.file.close()
@@ -0,0 +1,126 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Bounded hand-off between the BLE notification callback and the processing stages.
+# push() never blocks and never creates a task; when the consumers fall behind and the
+# queue is full the incoming packet is dropped and counted.
+class PacketQueue:
+    def __init__(self, maxsize=256):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.maxsize = maxsize
+        self.received_packets = 0
+        self.dropped_packets = 0
+        self.high_water_mark = 0
+
+    # Usable directly as the start_notify callback
+    def push(self, sender, data):
+        self.received_packets += 1
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.dropped_packets += 1
+            return
+        self.high_water_mark = max(self.high_water_mark, self.queue.qsize())
+
+    async def get(self):
+        return await self.queue.get()
+
+    # Everything already waiting, without suspending
+    def get_pending(self):
+        pending = []
+        while True:
+            try:
+                pending.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                return pending
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        return {
+            'depth': self.depth(),
+            'maxsize': self.maxsize,
+            'high_water_mark': self.high_water_mark,
+            'received_packets': self.received_packets,
+            'dropped_packets': self.dropped_packets,
+        }
+
+
+# Decode stage: hands each queued packet to on_packet, then wakes the next stage once per batch
+async def decode_stage(packet_queue, on_packet, data_ready):
+    while True:
+        data = await packet_queue.get()
+        on_packet(data)
+        for data in packet_queue.get_pending():
+            on_packet(data)
+        data_ready.set()
+
+
+# Feature stage: runs on_data_ready whenever the decode stage has produced new samples
+async def feature_stage(on_data_ready, data_ready):
+    while True:
+        await data_ready.wait()
+        data_ready.clear()
+        on_data_ready()
+
+
+# Output stage: periodic work (plotting, printing) decoupled from packet arrival
+async def output_stage(on_tick, period=0.1):
+    while True:
+        on_tick()
+        await asyncio.sleep(period)
+
+
+# Runs epoch computations on a thread or process pool. At most max_in_flight epochs are
+# submitted and not yet consumed; submit() waits for a free slot, and next_result() always
+# returns the oldest outstanding result so epochs come back in order.
+class EpochExecutor:
+    def __init__(self, mode='thread', max_workers=None, max_in_flight=4):
+        if mode == 'process':
+            self.pool = ProcessPoolExecutor(max_workers=max_workers)
+        elif mode == 'thread':
+            self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        else:
+            raise ValueError(f"Unknown executor mode: {mode}")
+        self.mode = mode
+        self.max_in_flight = max_in_flight
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.in_flight = asyncio.Queue()
+
+    async def submit(self, fn, *args):
+        await self.slots.acquire()
+        future = asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+        self.in_flight.put_nowait(future)
+
+    async def next_result(self):
+        future = await self.in_flight.get()
+        try:
+            return await future
+        finally:
+            self.slots.release()
+
+    def pending(self):
+        return self.in_flight.qsize()
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Feature stage backed by an EpochExecutor: next_job() returns the argument tuple for compute
+# (or None when no complete epoch is pending) and on_result() receives results in epoch order
+async def offloaded_feature_stage(next_job, compute, on_result, epoch_executor, data_ready):
+    async def submit_epochs():
+        while True:
+            await data_ready.wait()
+            data_ready.clear()
+            job = next_job()
+            while job is not None:
+                await epoch_executor.submit(compute, *job)
+                job = next_job()
+
+    async def collect_results():
+        while True:
+            on_result(await epoch_executor.next_result())
+
+    await asyncio.gather(submit_epochs(), collect_results())
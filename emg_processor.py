@@ -0,0 +1,359 @@
+import time
+import csv
+import importlib
+import threading
+from collections import deque
+import numpy as np
+from emg_stream import NotificationDecoder, RingBuffer, SharedRingBuffer, BlockEnvelope, SlidingWindowSums, sample_rate
+from emg_timeline import FeatureTimeline
+from emg_pyramid import FeaturePyramid
+from emg_features import batch_spectral_features, band_fatigue_index, StreamingFilterBank, SlidingDFT, StreamingSTFT
+from emg_features import OnlineRegression, slope_fatigue_index
+
+# Names of the live histories (signal, envelope, per-sample RMS/IEMG traces, algorithm B bands, spectrogram
+# columns and per-epoch features)
+history_names = ['amplitudes', 'envelope_values', 'rms_trace', 'iemg_trace', 'lfc_values', 'hfc_values', 'spectrogram',
+                 'rms_values', 'iemg_values', 'mnf_values', 'mpf_values', 'fatigue_A_values', 'fatigue_B_values']
+
+# Decoding, envelope, features and fatigue algorithms for one device, without any plotting or
+# keyboard handling, so headless tools can use it without importing matplotlib or keyboard.
+# RealTimePlotter in BLE_envelope_v4.py adds the live plots on top of it.
+class EMGProcessor:
+    # fatigue_B_method: 'filter' takes algorithm B from the streamed LFC/HFC band signals, 'spectrum'
+    # from the epoch spectrum already computed for MNF/MPF (no filtering, no scipy)
+    # fs: sample rate (Hz) every feature, band and time of the processor is computed with
+    # spectral_trace_step: if set, MNF/MPF of the last epoch_length samples are also tracked every that many
+    # samples with a sliding DFT, instead of only once per epoch
+    # slope_decay: per-epoch forgetting factor of the MNF/MPF trend regressions (1.0 fits every epoch equally)
+    # feature_levels: extra (window, step) resolutions computed alongside the 800/400 epochs, e.g.
+    # ((1000, 100), (400, 200)), each into its own timeline (self.pyramid.timelines[level])
+    def __init__(self, history_size=48000, feature_history_size=3600, shared=False, csv_path='egw1.csv', recorder=None,
+                 fatigue_B_method='filter', spectral_trace_step=None, spectrogram_columns=240, slope_decay=1.0,
+                 feature_levels=None, fs=sample_rate):
+        if fatigue_B_method not in ('filter', 'spectrum'):
+            raise ValueError(f"Unknown fatigue B method: {fatigue_B_method}")
+        self.fatigue_B_method = fatigue_B_method
+        self.fs = fs
+        self.decoder = NotificationDecoder()
+        # Live history is bounded: the signal keeps the last history_size samples, features the last feature_history_size epochs.
+        # With shared=True the buffers live in shared memory so another process (the plot window) can read them.
+        ring = SharedRingBuffer if shared else RingBuffer
+        self.shared = shared
+        self.amplitudes = ring(history_size)
+        self.envelope_values = ring(history_size)
+        # RMS and IEMG of the epoch ending at each sample
+        self.rms_trace = ring(history_size, dtype=np.float64)
+        self.iemg_trace = ring(history_size, dtype=np.float64)
+        # Signal band-passed to the algorithm B LFC (25-79 Hz) and HFC (80-350 Hz) bands
+        self.lfc_values = ring(history_size, dtype=np.float64)
+        self.hfc_values = ring(history_size, dtype=np.float64)
+        self.rms_values = ring(feature_history_size, dtype=np.float64)
+        self.iemg_values = ring(feature_history_size, dtype=np.float64)
+        self.mnf_values = ring(feature_history_size, dtype=np.float64)
+        self.mpf_values = ring(feature_history_size, dtype=np.float64)
+        self.fatigue_A_values = ring(feature_history_size, dtype=np.float64)
+        self.fatigue_B_values = ring(feature_history_size, dtype=np.float64)
+        # Every epoch of the session with its features and fatigue values. The fatigue algorithms and
+        # the CSV export read from it; the bounded rings above only mirror it for the live plots.
+        self.timeline = FeatureTimeline()
+        self.csv_path = csv_path
+        self.sample_count = 0
+        # Epochs are epoch_length samples every epoch_step samples; start_index/end_index delimit the next one
+        self.epoch_length = 800
+        self.epoch_step = 400
+        self.start_index = 0
+        self.end_index = self.epoch_length
+        # Most complete epochs found waiting at once, and epochs skipped because the signal ring overwrote them
+        self.max_epoch_lag = 0
+        self.skipped_epochs = 0
+        self.baseline_initialized = False
+        self.iemg_initial = None
+        self.fatigueA_start_index = 0
+        self.fatigueB_start_index = 0
+        # MNF and MPF against epoch start time (s), for the slope fatigue algorithm
+        self.mnf_trend = OnlineRegression(decay=slope_decay)
+        self.mpf_trend = OnlineRegression(decay=slope_decay)
+        self.packet_index = 0
+        # time.perf_counter() when the first samples were decoded
+        self.first_sample_time = None
+        # Start sample of every epoch handed out by next_epoch() whose features have not been added yet
+        self.pending_epoch_starts = deque()
+        # Optional SessionRecorder that everything is appended to as it is computed
+        self.recorder = recorder
+
+        self.envelope = BlockEnvelope(buffer_size=208)
+        self.window_sums = SlidingWindowSums(window=self.epoch_length)
+        # Created by update_bands() with the first epoch, scipy is slow to import
+        self.filter_bank = None
+
+        # Live spectrogram: the last spectrogram_columns STFT columns (dB), one every stft.hop samples
+        self.stft = StreamingSTFT(length=256, hop=64, fs=self.fs)
+        self.spectrogram = ring(spectrogram_columns, dtype=np.float32, shape=(self.stft.num_bins,))
+
+        self.pyramid = None
+        if feature_levels:
+            self.pyramid = FeaturePyramid(feature_levels, fs=self.fs, history_size=history_size)
+
+        # Sliding-DFT MNF/MPF traces; value i is of the window ending at sample epoch_length - 1 + i * spectral_trace_step
+        self.spectral_tracker = None
+        self.mnf_trace = None
+        self.mpf_trace = None
+        if spectral_trace_step is not None:
+            self.spectral_tracker = SlidingDFT(length=self.epoch_length, fs=self.fs, output_step=spectral_trace_step)
+            trace_size = max(history_size // spectral_trace_step, 1)
+            self.mnf_trace = ring(trace_size, dtype=np.float64)
+            self.mpf_trace = ring(trace_size, dtype=np.float64)
+
+    def histories(self):
+        return {name: getattr(self, name) for name in history_names}
+
+    def shared_specs(self):
+        return {name: history.spec() for name, history in self.histories().items()}
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.shared:
+            for history in self.histories().values():
+                history.close()
+            if self.spectral_tracker is not None:
+                self.mnf_trace.close()
+                self.mpf_trace.close()
+
+    # The feature rows cover the whole session, but the amplitudes row only holds what is left in the
+    # signal ring (the last history_size samples): amplitudes_first_sample is the session sample index
+    # of its first value and start_sample_values the first sample of every epoch, to line them up.
+    # The full signal is in the session recording (recorder) if there is one.
+    def save_csv(self):
+        with open(self.csv_path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(["ArrayID", "Array"])
+            # Write each array to a separate row with an identifier
+            writer.writerow(["amplitudes", ",".join(map(str, self.amplitudes.values().tolist()))])
+            writer.writerow(["amplitudes_first_sample", str(self.amplitudes.first_index())])
+            writer.writerow(["start_sample_values", ",".join(map(str, self.timeline.column('start_sample').tolist()))])
+            for name in ('rms', 'iemg', 'mnf', 'mpf'):
+                writer.writerow([f"{name}_values", ",".join(map(str, self.timeline.column(name).tolist()))])
+            for name in ('fatigue_A', 'fatigue_B'):
+                writer.writerow([f"{name}_values", ",".join(map(str, self.timeline.series(name).tolist()))])
+
+    def update_received_data(self, data):
+        self.packet_index += len(data)
+        #print("Length of received data:", len(data))
+        #print("Length of received data:", self.packet_index)
+
+        # Decode every whole float in the notification; a trailing partial float is kept for the next one
+        floats = self.decoder.decode(data)
+
+        if len(floats) > 0:
+            if self.first_sample_time is None:
+                self.first_sample_time = time.perf_counter()
+            #print("Float values:", floats)  # Print the extracted float values
+            self.amplitudes.extend(floats)
+            self.sample_count = self.amplitudes.total
+
+            envelope = self.envelope.process(floats)
+            self.envelope_values.extend(envelope)
+            if self.recorder is not None:
+                self.recorder.write_samples(floats, envelope)
+
+            rms, iemg = self.window_sums.process(floats)
+            self.rms_trace.extend(rms)
+            self.iemg_trace.extend(iemg)
+
+            if self.spectral_tracker is not None:
+                sample_indices, mnf, mpf = self.spectral_tracker.process(floats)
+                self.mnf_trace.extend(mnf)
+                self.mpf_trace.extend(mpf)
+
+            #print("Length of amplitudes:", len(self.amplitudes))
+            #print("Length of envelope_values:", len(self.envelope_values))
+
+    # Imports scipy on a background thread, e.g. while waiting for the first samples after connecting,
+    # so that the first update_bands() does not stall the event loop
+    def preload_filters(self):
+        if self.fatigue_B_method != 'filter':
+            return
+        threading.Thread(target=importlib.import_module, args=('scipy.signal',), daemon=True).start()
+
+    # Band-passes the samples that arrived since the last call into the LFC/HFC histories. This runs
+    # from the feature stage rather than per packet, so decoding never waits for the scipy import.
+    def update_bands(self):
+        start = max(self.lfc_values.total, self.amplitudes.first_index())
+        if start >= self.amplitudes.total:
+            return
+        if self.filter_bank is None:
+            self.filter_bank = StreamingFilterBank(fs=float(self.fs))
+        if start > self.lfc_values.total:
+            # Samples were overwritten before they were filtered: restart the filters after the gap
+            gap = np.zeros(start - self.lfc_values.total)
+            self.lfc_values.extend(gap)
+            self.hfc_values.extend(gap)
+            self.filter_bank.reset()
+        lfc, hfc = self.filter_bank.process(self.amplitudes.window(start, self.amplitudes.total))
+        self.lfc_values.extend(lfc)
+        self.hfc_values.extend(hfc)
+
+    # Adds the spectrogram columns completed by the samples that arrived since the last call. Like
+    # update_bands() this runs from the feature stage, not per packet.
+    def update_spectrogram(self):
+        start = max(self.stft.count, self.amplitudes.first_index())
+        if start >= self.amplitudes.total:
+            return
+        if start > self.stft.count:
+            # Samples were overwritten before they were transformed: start over after the gap
+            self.stft.reset()
+            self.stft.count = start
+        self.spectrogram.extend(self.stft.process(self.amplitudes.window(start, self.amplitudes.total)))
+
+    # Number of complete epochs that have arrived but have not been handed out by next_epochs()
+    def epoch_lag(self):
+        if self.amplitudes.total < self.end_index:
+            return 0
+        return (self.amplitudes.total - self.end_index) // self.epoch_step + 1
+
+    # Every complete epoch not handed out yet (at most max_epochs) as rows of a float64 copy of the
+    # signal (safe to hand to another thread/process), or None. Epochs whose samples have already
+    # been overwritten in the ring are skipped, so processing catches up with real time after a stall.
+    def next_epochs(self, max_epochs=None):
+        self.update_spectrogram()
+        if self.pyramid is not None:
+            self.pyramid.update(self.amplitudes)
+        num_epochs = self.epoch_lag()
+        self.max_epoch_lag = max(self.max_epoch_lag, num_epochs)
+        first_index = self.amplitudes.first_index()
+        if self.start_index < first_index:
+            skipped = min(-((self.start_index - first_index) // self.epoch_step), num_epochs)
+            self.skipped_epochs += skipped
+            num_epochs -= skipped
+            self.start_index += skipped * self.epoch_step
+            self.end_index = self.start_index + self.epoch_length
+        if max_epochs is not None:
+            num_epochs = min(num_epochs, max_epochs)
+        if num_epochs == 0:
+            return None
+
+        if self.fatigue_B_method == 'filter':
+            self.update_bands()
+        stop = self.start_index + (num_epochs - 1) * self.epoch_step + self.epoch_length
+        signal = self.amplitudes.window(self.start_index, stop).astype(np.float64)
+        epochs = np.lib.stride_tricks.sliding_window_view(signal, self.epoch_length)[::self.epoch_step]
+        self.pending_epoch_starts.extend(range(self.start_index, self.start_index + num_epochs * self.epoch_step, self.epoch_step))
+        self.start_index += num_epochs * self.epoch_step
+        self.end_index = self.start_index + self.epoch_length
+        return epochs
+
+    # Next complete epoch, or None
+    def next_epoch(self):
+        epochs = self.next_epochs(max_epochs=1)
+        return None if epochs is None else epochs[0]
+
+    # Arguments for spectral_features when it runs on an executor. In filter mode the epoch's LFC/HFC
+    # windows go with it, so algorithm B is computed by the worker as well, not on the event loop.
+    def next_epoch_job(self):
+        epoch_data = self.next_epoch()
+        if epoch_data is None:
+            return None
+        fatigue_bands = None
+        if self.fatigue_B_method == 'filter':
+            lfc, hfc = self.epoch_bands(self.pending_epoch_starts[-1])
+            fatigue_bands = (lfc.copy(), hfc.copy())
+        return epoch_data, self.fs, None, self.fatigue_B_method == 'spectrum', fatigue_bands
+
+    # features holds the spectral features of the oldest pending epoch; its RMS and IEMG are read
+    # from the running traces at the epoch's last sample
+    def add_epoch_features(self, features):
+        start_sample = self.pending_epoch_starts.popleft()
+        end_sample = start_sample + self.epoch_length
+        features = dict(features, rms=self.rms_trace.at(end_sample - 1), iemg=self.iemg_trace.at(end_sample - 1))
+        epoch = self.timeline.append(start_sample=start_sample, time=time.time(), rms=features['rms'],
+                                     iemg=features['iemg'], mnf=features['mnf'], mpf=features['mpf'])
+        if self.recorder is not None:
+            self.recorder.write_epoch(start_sample, features)
+
+        self.rms_values.append(features['rms'])
+        self.iemg_values.append(features['iemg'])
+
+        self.algorithm_B_fatigue(features.get('fatigue_B'))
+        self.algorithm_A_fatigue(epoch)
+        self.slope_fatigue(epoch)
+
+        self.mnf_values.append(features['mnf'])
+        self.mpf_values.append(features['mpf'])
+
+    # Computes every pending epoch in one batch, so a stalled loop catches up on its next call
+    def features_calculation(self):
+        epochs = self.next_epochs()
+        if epochs is not None:
+            features = batch_spectral_features(epochs, fs=self.fs, fatigue_B_from_spectrum=self.fatigue_B_method == 'spectrum')
+            for i in range(len(epochs)):
+                self.add_epoch_features({name: values[i] for name, values in features.items()})
+
+    # Runs while adding epoch `epoch` and only looks at the MPF of the epochs before it
+    def algorithm_A_fatigue(self, epoch):
+        mpf_values = self.timeline.column('mpf')[:epoch]
+        if len(mpf_values) >= 10 + self.fatigueA_start_index:  
+            if not self.baseline_initialized:
+                self.baseline = np.mean(mpf_values[0:5])
+                print("Baseline value:", self.baseline)
+                self.baseline_initialized = True
+
+            self.fatigueA_start_index += 5
+            recent_mpf_values = mpf_values[-5:]
+            average_mpf = np.mean(recent_mpf_values)
+
+            if average_mpf >= self.baseline:
+                self.baseline = average_mpf
+            
+            fatigue_level = ((self.baseline - average_mpf) / self.baseline) * 100
+            self.timeline.set(epoch, 'fatigue_A', fatigue_level)
+            self.fatigue_A_values.append(fatigue_level)
+            if self.recorder is not None:
+                self.recorder.write_fatigue('A', fatigue_level)
+            print(f"Fatigue Level: {fatigue_level}")
+
+    # Slope algorithm: online regressions of MNF and MPF against time, O(1) per epoch. The fatigue index
+    # is the percentage of the fitted starting MNF lost per minute; with few epochs or a noisy trend
+    # check slope_confidence() before trusting it.
+    def slope_fatigue(self, epoch):
+        record = self.timeline.records()[epoch]
+        epoch_time = record['start_sample'] / self.fs
+        self.mnf_trend.update(epoch_time, record['mnf'])
+        self.mpf_trend.update(epoch_time, record['mpf'])
+        self.timeline.set(epoch, 'mnf_slope', self.mnf_trend.slope())
+        self.timeline.set(epoch, 'fatigue_slope', slope_fatigue_index(self.mnf_trend))
+
+    # MNF slope (Hz/s), its 95 % confidence interval and R^2
+    def slope_confidence(self):
+        return self.mnf_trend.slope(), self.mnf_trend.confidence_interval(), self.mnf_trend.r_squared()
+
+    # Streamed LFC and HFC of the epoch starting at start_sample (views into the rings)
+    def epoch_bands(self, start_sample):
+        end_sample = start_sample + self.epoch_length
+        return self.lfc_values.window(start_sample, end_sample), self.hfc_values.window(start_sample, end_sample)
+
+    # Algorithm B fatigue index of the epoch starting at start_sample, from the streamed LFC/HFC bands
+    def epoch_fatigue_B_index(self, start_sample):
+        lfc, hfc = self.epoch_bands(start_sample)
+        return band_fatigue_index(lfc, hfc, fs=self.fs)
+
+    # fatigue_index is given when it was already computed with the epoch's spectral features
+    def algorithm_B_fatigue(self, fatigue_index=None):
+        if (len(self.timeline) > self.fatigueB_start_index):  
+            record = self.timeline.records()[self.fatigueB_start_index]
+            iemg_current = record['iemg']
+            
+            if self.iemg_initial is None:
+                self.iemg_initial = iemg_current
+                print("Initial IEMG value:", self.iemg_initial)
+
+            if iemg_current > self.iemg_initial:
+                print("Algorithm B Triggered")
+                if fatigue_index is None:
+                    fatigue_index = self.epoch_fatigue_B_index(record['start_sample'])
+                self.timeline.set(self.fatigueB_start_index, 'fatigue_B', fatigue_index)
+                self.fatigue_B_values.append(fatigue_index)
+                if self.recorder is not None:
+                    self.recorder.write_fatigue('B', fatigue_index)
+                print(f"Fatigue Index: {fatigue_index}")
+            self.fatigueB_start_index += 1
@@ -0,0 +1,119 @@
+import math
+import time
+import numpy as np
+from emg_stream import RingBuffer
+from emg_features import batch_spectral_features
+from emg_timeline import FeatureTimeline
+
+# RMS, IEMG, MNF and MPF at several (window, step) resolutions at once, each level into its own
+# FeatureTimeline (levels[i] -> timelines[levels[i]]). Epoch i of a level starts at sample i * step.
+#
+# The levels share one pass over the signal: running prefix sums of x^2 and |x| are kept once,
+# so any level's RMS/IEMG is a difference of two prefix values (O(1) per epoch, whatever the
+# window), and levels with the same window length share one batched FFT (through the cached
+# spectral plan) over the union of their epochs, e.g. (800, 400) and (800, 200).
+#
+# The prefix sums grow with the session; in float64 the error this adds to a window sum stays
+# around 1e-12 relative over hours of EMG.
+class FeaturePyramid:
+    def __init__(self, levels=((800, 400),), fs=800, history_size=48000, chunk_epochs=64):
+        self.levels = [tuple(level) for level in levels]
+        for window, step in self.levels:
+            # The signal history must be able to hold a whole epoch, otherwise the level never completes one
+            if window > history_size:
+                raise ValueError(f"Level window {window} is longer than the history ({history_size} samples)")
+        self.fs = fs
+        self.chunk_epochs = chunk_epochs
+        # Epochs of the levels sharing a window length all start on the grid of their steps' gcd
+        self.steps = {}
+        for window, step in self.levels:
+            self.steps[window] = math.gcd(self.steps.get(window, 0), step)
+        self.timelines = {level: FeatureTimeline() for level in self.levels}
+        self.next_starts = {level: 0 for level in self.levels}
+        # Prefix value j is the sum over samples origin .. origin + j - 1
+        self.sum_squares = RingBuffer(history_size + 1, dtype=np.float64)
+        self.sum_abs = RingBuffer(history_size + 1, dtype=np.float64)
+        self.restart(0)
+
+    def restart(self, origin):
+        self.origin = origin
+        self.sum_squares.clear()
+        self.sum_abs.clear()
+        self.sum_squares.append(0.0)
+        self.sum_abs.append(0.0)
+        for level in self.levels:
+            window, step = level
+            # First epoch on the level's grid that starts at or after the origin
+            skipped = max(-((self.next_starts[level] - origin) // step), 0)
+            self.next_starts[level] += skipped * step
+
+    # Consumes the samples of history (a RingBuffer indexed by absolute sample) that arrived since
+    # the last call and adds every epoch they complete to the level timelines
+    def update(self, history):
+        position = self.origin + self.sum_squares.total - 1
+        if min(position, *self.next_starts.values()) < history.first_index():
+            # Samples were overwritten before they were seen, or before a pending epoch was computed:
+            # the prefix sums and every level start over after the gap
+            self.restart(history.first_index())
+            position = self.origin
+        if position < history.total:
+            block = history.window(position, history.total).astype(np.float64)
+            self.sum_squares.extend(self.sum_squares.at(self.sum_squares.total - 1) + np.cumsum(np.square(block)))
+            self.sum_abs.extend(self.sum_abs.at(self.sum_abs.total - 1) + np.cumsum(np.abs(block)))
+
+        new_starts = {}
+        for level in self.levels:
+            window, step = level
+            first_start = self.next_starts[level]
+            if history.total < first_start + window:
+                continue
+            num_epochs = (history.total - first_start - window) // step + 1
+            new_starts[level] = first_start + step * np.arange(num_epochs)
+            self.next_starts[level] = first_start + step * num_epochs
+        if not new_starts:
+            return
+
+        now = time.time()
+        spectral = self.spectral_features(history, new_starts)
+        for level, starts in new_starts.items():
+            window, step = level
+            sum_squares = self.window_sums(self.sum_squares, starts, window)
+            self.timelines[level].extend(start_sample=starts, time=now,
+                                         rms=np.sqrt(sum_squares / window),
+                                         iemg=self.window_sums(self.sum_abs, starts, window),
+                                         mnf=spectral[level]['mnf'], mpf=spectral[level]['mpf'])
+
+    def window_sums(self, prefix, starts, window):
+        first = starts[0] - self.origin
+        values = prefix.window(first, starts[-1] - self.origin + window + 1)
+        return values[starts - self.origin - first + window] - values[starts - self.origin - first]
+
+    # MNF/MPF of the new epochs of every level, one batched FFT per window length
+    def spectral_features(self, history, new_starts):
+        spectral = {}
+        for window in {level[0] for level in new_starts}:
+            levels = [level for level in new_starts if level[0] == window]
+            starts = np.unique(np.concatenate([new_starts[level] for level in levels]))
+            signal = history.window(starts[0], starts[-1] + window).astype(np.float64)
+            epochs = np.lib.stride_tricks.sliding_window_view(signal, window)[::self.steps[window]]
+            offsets = (starts - starts[0]) // self.steps[window]
+            # Chunks keep the spectra small enough to stay in cache
+            chunks = [batch_spectral_features(epochs[offsets[i:i + self.chunk_epochs]], fs=self.fs)
+                      for i in range(0, len(offsets), self.chunk_epochs)]
+            features = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+            for level in levels:
+                rows = np.searchsorted(starts, new_starts[level])
+                spectral[level] = {name: values[rows] for name, values in features.items()}
+        return spectral
+
+
+# Every level over a whole recorded signal at once
+def pyramid_features(signal, levels=((800, 400),), fs=800):
+    signal = np.asarray(signal)
+    # A recording shorter than a level's window gives that level no epochs, as in batch_epoch_features
+    history_size = max(len(signal), *(window for window, step in levels))
+    history = RingBuffer(history_size, dtype=signal.dtype)
+    history.extend(signal)
+    pyramid = FeaturePyramid(levels, fs=fs, history_size=history_size)
+    pyramid.update(history)
+    return pyramid.timelines
@@ -0,0 +1,122 @@
+import json
+import os
+import time
+import numpy as np
+from emg_stream import sample_dtype
+from emg_logging import BackgroundWriter
+
+# Append-only binary session recording. A session is a directory holding a small JSON header
+# and one flat little-endian file per stream, appended to while recording:
+#
+#   header.json     sample rate, device, filter config, dtypes
+#   samples.f32     raw decoded samples
+#   envelope.f32    moving-average envelope, one value per sample
+#   epochs.bin      one epoch_dtype record per epoch (start sample, wall time, features)
+#   fatigue_A.f64   fatigue A series
+#   fatigue_B.f64   fatigue B series
+#
+# Nothing is rewritten, so a crash loses at most the last unflushed writes, and load_session()
+# maps every stream straight back as a NumPy array without parsing. The files are written by
+# BackgroundWriter threads, so recording does not block the event loop.
+#
+# Version 2 headers also hold the algorithm B method (fatigue_B_method); version 1 headers stored
+# 200 as sample_rate, while the pipeline always ran at 800 Hz.
+
+format_version = 2
+
+epoch_dtype = np.dtype([
+    ('start_sample', '<i8'),
+    ('time', '<f8'),
+    ('rms', '<f8'),
+    ('iemg', '<f8'),
+    ('mnf', '<f8'),
+    ('mpf', '<f8'),
+])
+
+stream_dtypes = {
+    'samples': sample_dtype,
+    'envelope': sample_dtype,
+    'epochs': epoch_dtype,
+    'fatigue_A': np.dtype('<f8'),
+    'fatigue_B': np.dtype('<f8'),
+}
+
+stream_files = {
+    'samples': 'samples.f32',
+    'envelope': 'envelope.f32',
+    'epochs': 'epochs.bin',
+    'fatigue_A': 'fatigue_A.f64',
+    'fatigue_B': 'fatigue_B.f64',
+}
+
+class SessionRecorder:
+    def __init__(self, path, sample_rate, device='', filter_config=None, fatigue_B_method=None, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        os.makedirs(path, exist_ok=True)
+        header = {
+            'format_version': format_version,
+            'sample_rate': sample_rate,
+            'device': device,
+            'filter_config': filter_config or {},
+            'fatigue_B_method': fatigue_B_method,
+            'start_time': time.time(),
+            'streams': {name: {'file': stream_files[name], 'dtype': dtype_to_header(stream_dtypes[name])}
+                        for name in stream_files},
+        }
+        with open(os.path.join(path, 'header.json'), 'w') as file:
+            json.dump(header, file, indent=2)
+        self.writers = {name: BackgroundWriter(os.path.join(path, file_name), fmt='binary', dtype=stream_dtypes[name],
+                                               flush_interval=flush_interval)
+                        for name, file_name in stream_files.items()}
+
+    def write(self, stream, values):
+        self.writers[stream].write(values)
+
+    def write_samples(self, samples, envelope):
+        self.write('samples', samples)
+        self.write('envelope', envelope)
+
+    def write_epoch(self, start_sample, features):
+        record = np.zeros(1, dtype=epoch_dtype)
+        record['start_sample'] = start_sample
+        record['time'] = time.time()
+        for name in ('rms', 'iemg', 'mnf', 'mpf'):
+            record[name] = features[name]
+        self.write('epochs', record)
+
+    def write_fatigue(self, algorithm, value):
+        self.write(f'fatigue_{algorithm}', [value])
+
+    def stats(self):
+        return {name: writer.stats() for name, writer in self.writers.items()}
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+def dtype_to_header(dtype):
+    return dtype.str if dtype.names is None else dtype.descr
+
+def dtype_from_header(descr):
+    if isinstance(descr, str):
+        return np.dtype(descr)
+    return np.dtype([tuple(field) for field in descr])
+
+def map_stream(path, dtype):
+    dtype = np.dtype(dtype)
+    num_records = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+    if num_records == 0:
+        return np.empty(0, dtype=dtype)
+    # A record cut short by a crash is ignored
+    return np.memmap(path, dtype=dtype, mode='r', shape=(num_records,))
+
+# Returns a dict with the header and every stream as a read-only memory-mapped array
+def load_session(path):
+    with open(os.path.join(path, 'header.json'), 'r') as file:
+        header = json.load(file)
+    session = {'header': header}
+    for name, stream in header['streams'].items():
+        session[name] = map_stream(os.path.join(path, stream['file']), dtype_from_header(stream['dtype']))
+    return session
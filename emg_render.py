@@ -0,0 +1,205 @@
+import matplotlib.pyplot as plt
+import numpy as np
+from emg_stream import SharedRingBuffer
+
+# Reduces values to one (min, max) pair per bucket so a line never has more points than the
+# axes has pixels. Returns the indices into values to plot them at, and the reduced values.
+def minmax_decimate(values, num_buckets):
+    num_values = len(values)
+    if num_buckets <= 0 or num_values <= 2 * num_buckets:
+        return np.arange(num_values), values
+    bucket_size = num_values // num_buckets
+    # Drop the oldest few samples so the buckets line up with the newest one
+    start = num_values - bucket_size * num_buckets
+    buckets = values[start:].reshape(num_buckets, bucket_size)
+    reduced = np.empty(2 * num_buckets, dtype=values.dtype)
+    reduced[0::2] = buckets.min(axis=1)
+    reduced[1::2] = buckets.max(axis=1)
+    indices = np.repeat(start + np.arange(num_buckets) * bucket_size, 2)
+    indices[1::2] += bucket_size - 1
+    return indices, reduced
+
+
+# The live figures: EMG/RMS/IEMG/MNF-MPF, Fatigue A/B and the spectrogram.
+# update() takes a dict of history name -> RingBuffer (or SharedRingBuffer), see EMGProcessor.histories().
+#
+# The live view shows a fixed window (the last window_size samples and feature_window epochs,
+# x = 0 is the newest value), so the axes never change: their background is rendered once and
+# each frame only redraws the lines on top of it (blitting), decimated to the axes pixel width.
+# Drawing cost per frame therefore does not depend on how long the session has been running.
+#
+# The spectrogram is one image artist over a preallocated (bins, spectrogram_columns) array that
+# each frame overwrites in place with the newest columns of the 'spectrogram' history (columns of
+# spectrogram_hop samples, power in dB, see EMGProcessor.update_spectrogram).
+class LivePlotWindow:
+    def __init__(self, window_size=1000, feature_window=120, spectrogram_columns=240, spectrogram_length=256, spectrogram_hop=64,
+                 fs=800, spectrogram_db_range=(0.0, 80.0)):
+        self.window_size = window_size
+        self.feature_window = feature_window
+        self.spectrogram_columns = spectrogram_columns
+        # First figure for EMG signal and its envelope
+        plt.ion()
+        self.fig_emg, ( self.ax_emg, self.ax_rms, self.ax_iemg, self.ax_mnf) = plt.subplots(4)
+        self.line_emg, = self.ax_emg.plot([], [], 'b-', label='EMG Data')
+        self.envelope_line_emg, = self.ax_emg.plot([], [], 'r-', label='Envelope')
+        self.line_rms, = self.ax_rms.plot([], [], 'g-', label='RMS')
+        self.line_iemg, = self.ax_iemg.plot([], [], 'm-', label='IEMG')
+        self.line_mnf, = self.ax_mnf.plot([], [], 'r-', label='MNF')
+        self.line_mpf, = self.ax_mnf.plot([], [], 'g-', label='MPF')
+
+        # Set labels and legends
+        self.ax_emg.set_xlabel('Time (sec)')
+        self.ax_emg.set_ylabel('EMG Amplitude')
+        #self.ax_emg.set_title('Real-time EMG Data')
+        self.ax_emg.set_ylim(-100.0, 100.0)
+        self.ax_emg.legend()
+
+        self.ax_rms.set_xlabel('Time (sec)')
+        self.ax_rms.set_ylabel('RMS Value')
+        #self.ax_rms.set_title('RMS')
+        self.ax_rms.set_ylim(0.0, 100.0)
+        self.ax_rms.legend()
+
+        self.ax_iemg.set_xlabel('Time (sec)')
+        self.ax_iemg.set_ylabel('IEMG Value')
+        #self.ax_iemg.set_title('IEMG')
+        self.ax_iemg.set_ylim(0.0, 15000.0)
+        self.ax_iemg.legend()
+
+        # Set labels and legends for the frequency plot
+        self.ax_mnf.set_xlabel('Time (sec)')
+        self.ax_mnf.set_ylabel('Frequency (Hz)')
+        #self.ax_mnf.set_title('MNF/MPF')
+        self.ax_mnf.set_ylim(0.0, 200.0)
+        self.ax_mnf.legend()
+
+        # Add a new figure for plotting fatigue values
+        self.fig_fatigue, (self.ax_fatigue_A, self.ax_fatigue_B) = plt.subplots(2)
+        self.line_fatigue_A, = self.ax_fatigue_A.plot([], [], 'b-', label='Fatigue A')
+        self.line_fatigue_B, = self.ax_fatigue_B.plot([], [], 'r-', label='Fatigue B')
+
+        # Set labels and legends for fatigue plots
+        self.ax_fatigue_A.set_xlabel('Time (sec)')
+        self.ax_fatigue_A.set_ylabel('Fatigue A Level')
+        self.ax_fatigue_A.set_ylim(-20.0, 120.0)
+        self.ax_fatigue_A.legend()
+
+        self.ax_fatigue_B.set_xlabel('Time (sec)')
+        self.ax_fatigue_B.set_ylabel('Fatigue B Level')
+        self.ax_fatigue_B.set_ylim(-20.0, 350.0)
+        self.ax_fatigue_B.legend()
+
+        # Spectrogram figure; newest column at the right edge (t = 0)
+        self.fig_spectrogram, self.ax_spectrogram = plt.subplots()
+        # Non-negative frequency bins of the full FFT (SpectralPlan.num_positive)
+        num_bins = (spectrogram_length + 1) // 2
+        self.spectrogram_image = np.full((num_bins, spectrogram_columns), np.nan, dtype=np.float32)
+        self.image_spectrogram = self.ax_spectrogram.imshow(
+            self.spectrogram_image, origin='lower', aspect='auto', interpolation='nearest', animated=True,
+            extent=(-spectrogram_columns * spectrogram_hop / fs, 0, 0, fs / 2),
+            vmin=spectrogram_db_range[0], vmax=spectrogram_db_range[1])
+        self.ax_spectrogram.set_xlabel('Time (sec)')
+        self.ax_spectrogram.set_ylabel('Frequency (Hz)')
+        self.fig_spectrogram.colorbar(self.image_spectrogram, ax=self.ax_spectrogram, label='Power (dB)')
+
+        # (line, axes, history name, visible length) for everything drawn live
+        self.lines = [
+            (self.line_emg, self.ax_emg, 'amplitudes', window_size),
+            (self.envelope_line_emg, self.ax_emg, 'envelope_values', window_size),
+            (self.line_rms, self.ax_rms, 'rms_values', feature_window),
+            (self.line_iemg, self.ax_iemg, 'iemg_values', feature_window),
+            (self.line_mnf, self.ax_mnf, 'mnf_values', feature_window),
+            (self.line_mpf, self.ax_mnf, 'mpf_values', feature_window),
+            (self.line_fatigue_A, self.ax_fatigue_A, 'fatigue_A_values', feature_window),
+            (self.line_fatigue_B, self.ax_fatigue_B, 'fatigue_B_values', feature_window),
+        ]
+        for line, ax, name, visible in self.lines:
+            line.set_animated(True)
+            ax.set_xlim(-visible, 0)
+
+        self.figures = [self.fig_emg, self.fig_fatigue, self.fig_spectrogram]
+        self.backgrounds = {}
+        for fig in self.figures:
+            fig.canvas.mpl_connect('draw_event', self.on_draw)
+            fig.canvas.draw()
+        plt.show(block=False)
+
+    # Any full redraw (first show, resize) re-captures the static background of that figure
+    def on_draw(self, event):
+        fig = event.canvas.figure
+        if fig.canvas.supports_blit:
+            self.backgrounds[fig] = fig.canvas.copy_from_bbox(fig.bbox)
+        self.draw_animated(fig)
+
+    def draw_animated(self, fig):
+        for line, ax, name, visible in self.lines:
+            if ax.figure is fig:
+                ax.draw_artist(line)
+        if fig is self.fig_spectrogram:
+            self.ax_spectrogram.draw_artist(self.image_spectrogram)
+
+    def set_line_data(self, line, ax, history, visible):
+        first_index, values = history.snapshot(visible)
+        indices, reduced = minmax_decimate(values, int(ax.bbox.width))
+        # x = 0 is the newest value
+        line.set_data(indices - len(values) + 1, reduced)
+
+    # Newest columns at the right, columns not recorded yet are left blank (NaN)
+    def set_spectrogram_data(self, history):
+        first_index, columns = history.snapshot(self.spectrogram_columns)
+        num_blank = self.spectrogram_columns - len(columns)
+        self.spectrogram_image[:, :num_blank] = np.nan
+        self.spectrogram_image[:, num_blank:] = columns.T
+        self.image_spectrogram.set_data(self.spectrogram_image)
+
+    def update(self, histories):
+        for line, ax, name, visible in self.lines:
+            self.set_line_data(line, ax, histories[name], visible)
+        self.set_spectrogram_data(histories['spectrogram'])
+
+        for fig in self.figures:
+            canvas = fig.canvas
+            background = self.backgrounds.get(fig)
+            if background is None:
+                # Backend without blitting support (or not drawn yet)
+                canvas.draw_idle()
+                continue
+            canvas.restore_region(background)
+            self.draw_animated(fig)
+            canvas.blit(fig.bbox)
+        self.fig_emg.canvas.flush_events()
+
+    # Lets the GUI process events for `interval` seconds without triggering a full redraw
+    def wait(self, interval):
+        self.fig_emg.canvas.start_event_loop(interval)
+
+    # Final, static view of everything still held in the histories, with absolute x values
+    def show_all(self, histories):
+        for line, ax, name, visible in self.lines:
+            first_index, values = histories[name].snapshot()
+            indices, reduced = minmax_decimate(values, int(ax.bbox.width))
+            line.set_animated(False)
+            line.set_data(indices + first_index, reduced)
+            ax.set_xlim(first_index, max(first_index + len(values), 1))
+        self.set_spectrogram_data(histories['spectrogram'])
+        self.image_spectrogram.set_animated(False)
+        for fig in self.figures:
+            fig.canvas.draw_idle()
+
+
+# Entry point of the separate plotting process. specs maps history name -> SharedRingBuffer.spec();
+# the acquisition process sets stop_event when recording ends, after which the final state stays
+# on screen until the windows are closed.
+def run_render_process(specs, stop_event, interval=0.1, window_size=1000):
+    histories = {name: SharedRingBuffer.attach(spec) for name, spec in specs.items()}
+    window = LivePlotWindow(window_size=window_size)
+    try:
+        while not stop_event.is_set():
+            window.update(histories)
+            window.wait(interval)
+        window.show_all(histories)
+        plt.ioff()
+        plt.show()
+    finally:
+        for history in histories.values():
+            history.close()
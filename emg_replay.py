@@ -0,0 +1,212 @@
+import asyncio
+import csv
+import importlib
+import os
+import struct
+import time
+import numpy as np
+from emg_stream import sample_dtype, sample_rate, filtered_characteristic_uuid
+
+# Replays recorded notifications through the same callback path as BleakClient.start_notify, so
+# the processing pipeline can be driven (and load tested) without a radio.
+#
+# Sources:
+#   received_floats.txt  - one notification per line, written by thesis_BioAmp/plot.py
+#   egw1.csv             - the "amplitudes" row written by BLE_envelope_v4.py, cut into packets
+#   raw capture          - notifications with their arrival times, written by NotificationCapture
+#
+# speed: 1.0 plays in real time, N plays N times faster, None plays as fast as possible.
+
+# Matches the firmware: 59 floats per 236-byte packet
+samples_per_packet = 59
+
+capture_record = struct.Struct('<dI')
+
+
+def packets_from_floats(values, samples_per_packet=samples_per_packet):
+    data = np.asarray(values, dtype=sample_dtype).tobytes()
+    packet_size = samples_per_packet * sample_dtype.itemsize
+    return [data[i:i + packet_size] for i in range(0, len(data), packet_size)]
+
+def load_received_floats(path):
+    packets = []
+    with open(path, 'r') as file:
+        for line in file:
+            values = [float(val) for val in line.strip().rstrip(',').split(',') if val.strip()]
+            if values:
+                packets.append(np.asarray(values, dtype=sample_dtype).tobytes())
+    return packets
+
+def load_egw1_csv(path, samples_per_packet=samples_per_packet):
+    # The whole signal is one field, far longer than the csv module's default limit (128 KiB)
+    csv.field_size_limit(max(csv.field_size_limit(), os.path.getsize(path)))
+    with open(path, 'r', newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        next(reader)  # Skip header row
+        for row in reader:
+            if row[0] == 'amplitudes':
+                values = [float(val) for val in row[1].split(',') if val]
+                return packets_from_floats(values, samples_per_packet)
+    raise ValueError(f"No amplitudes row in {path}")
+
+def load_capture(path):
+    packets = []
+    timestamps = []
+    with open(path, 'rb') as file:
+        while True:
+            header = file.read(capture_record.size)
+            if len(header) < capture_record.size:
+                break
+            timestamp, length = capture_record.unpack(header)
+            data = file.read(length)
+            if len(data) < length:
+                break
+            packets.append(data)
+            timestamps.append(timestamp)
+    return packets, timestamps
+
+# Picks the loader from the file name; returns (packets, timestamps or None)
+def load_replay_source(path):
+    if path.endswith('.txt'):
+        return load_received_floats(path), None
+    if path.endswith('.csv'):
+        return load_egw1_csv(path), None
+    return load_capture(path)
+
+
+# Records raw notifications with their arrival time so a session can be replayed with the
+# original inter-packet timing. wrap() returns a start_notify callback that records and forwards.
+class NotificationCapture:
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+
+    def record(self, data):
+        self.file.write(capture_record.pack(time.time(), len(data)))
+        self.file.write(data)
+
+    def wrap(self, callback):
+        def capture_and_forward(sender, data):
+            self.record(data)
+            callback(sender, data)
+        return capture_and_forward
+
+    def close(self):
+        self.file.close()
+
+
+# Stand-in for BleakClient with the methods the acquisition scripts use
+class ReplayClient:
+    def __init__(self, packets, timestamps=None, speed=1.0, sample_rate=sample_rate, address='replay'):
+        self.packets = packets
+        # Without recorded arrival times, each packet follows the previous one after the time its
+        # samples take at sample_rate
+        if timestamps is None:
+            num_samples = np.cumsum([0] + [len(data) // sample_dtype.itemsize for data in packets[:-1]])
+            timestamps = (num_samples / sample_rate).tolist()
+        self.timestamps = timestamps
+        self.speed = speed
+        self.address = address
+        self.is_connected = False
+        self.playback = None
+        self.packets_sent = 0
+        self.start_time = None
+        self.end_time = None
+
+    @classmethod
+    def from_file(cls, path, speed=1.0, **kwargs):
+        packets, timestamps = load_replay_source(path)
+        return cls(packets, timestamps=timestamps, speed=speed, address=path, **kwargs)
+
+    async def connect(self):
+        self.is_connected = True
+        return True
+
+    async def start_notify(self, characteristic_uuid, callback):
+        self.playback = asyncio.ensure_future(self.play(characteristic_uuid, callback))
+
+    async def play(self, sender, callback):
+        loop = asyncio.get_running_loop()
+        self.start_time = time.monotonic()
+        loop_start = loop.time()
+        first_timestamp = self.timestamps[0] if self.timestamps else 0.0
+        for data, timestamp in zip(self.packets, self.timestamps):
+            if self.speed:
+                # Schedule against the start time so timing errors do not accumulate
+                delay = loop_start + (timestamp - first_timestamp) / self.speed - loop.time()
+                await asyncio.sleep(max(delay, 0))
+            else:
+                await asyncio.sleep(0)
+            callback(sender, bytearray(data))
+            self.packets_sent += 1
+        self.end_time = time.monotonic()
+
+    async def wait_finished(self):
+        if self.playback is not None:
+            await self.playback
+
+    async def stop_notify(self, characteristic_uuid):
+        if self.playback is not None:
+            self.playback.cancel()
+
+    async def disconnect(self):
+        await self.stop_notify(None)
+        self.is_connected = False
+        return True
+
+    def stats(self):
+        elapsed = 0.0
+        if self.start_time is not None:
+            end_time = self.end_time if self.end_time is not None else time.monotonic()
+            elapsed = end_time - self.start_time
+        num_bytes = sum(len(data) for data in self.packets[:self.packets_sent])
+        return {
+            'packets': self.packets_sent,
+            'elapsed': elapsed,
+            'packets_per_sec': self.packets_sent / elapsed if elapsed > 0 else float('inf'),
+            'samples_per_sec': num_bytes / sample_dtype.itemsize / elapsed if elapsed > 0 else float('inf'),
+        }
+
+
+# Drives the headless pipeline (decode + features) from a recording and reports how fast it
+# keeps up. With speed=None this is the maximum sustainable throughput of the pipeline.
+async def measure_throughput(path, speed=None, queue_size=256):
+    from emg_pipeline import PacketQueue, decode_stage, feature_stage
+    from emg_processor import EMGProcessor
+
+    processor = EMGProcessor()
+    # scipy is otherwise imported by the first epoch, inside the timed run
+    if processor.fatigue_B_method == 'filter':
+        importlib.import_module('scipy.signal')
+    client = ReplayClient.from_file(path, speed=speed)
+    packet_queue = PacketQueue(maxsize=queue_size)
+    data_ready = asyncio.Event()
+
+    await client.connect()
+    await client.start_notify(filtered_characteristic_uuid, packet_queue.push)
+    stages = asyncio.gather(decode_stage(packet_queue, processor.update_received_data, data_ready),
+                            feature_stage(processor.features_calculation, data_ready))
+    await client.wait_finished()
+    # Let the stages drain what is still queued; a stage that failed ends the run with its error
+    while (packet_queue.depth() > 0 or data_ready.is_set()) and not stages.done():
+        await asyncio.sleep(0)
+    stages.cancel()
+    try:
+        await stages
+    except asyncio.CancelledError:
+        pass
+    await client.disconnect()
+
+    stats = client.stats()
+    stats.update(packet_queue.stats())
+    stats['epochs'] = processor.rms_values.total
+    return stats
+
+
+if __name__ == '__main__':
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else 'thesis_BioAmp/received_floats.txt'
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    stats = asyncio.run(measure_throughput(path, speed=speed))
+    print(f"Replayed {stats['packets']} packets in {stats['elapsed']:.3f} s: "
+          f"{stats['packets_per_sec']:.0f} packets/s, {stats['samples_per_sec']:.0f} samples/s, "
+          f"{stats['epochs']} epochs, dropped {stats['dropped_packets']}, high-water mark {stats['high_water_mark']}")
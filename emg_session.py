@@ -0,0 +1,135 @@
+import asyncio
+import time
+from bleak import BleakClient
+from emg_pipeline import PacketQueue, decode_stage, feature_stage
+from emg_processor import EMGProcessor
+from emg_stream import filtered_characteristic_uuid, sample_rate
+
+# One peripheral in a multi-device session: its own BleakClient, packet queue and processing
+# pipeline (a headless EMGProcessor). New epochs are pushed to the shared output queue as
+# records tagged with the device name. start_sample is the epoch's first sample in the device's
+# stream; sample_time puts it on the wall clock (first packet arrival + start_sample / sample_rate), so
+# records of different devices can be aligned even when epochs were skipped or computed in a batch.
+class DeviceSession:
+    def __init__(self, name, address, output, queue_size=256, sample_rate=sample_rate):
+        self.name = name
+        self.address = address
+        self.output = output
+        self.sample_rate = sample_rate
+        self.client = BleakClient(address)
+        self.packet_queue = PacketQueue(maxsize=queue_size)
+        self.data_ready = asyncio.Event()
+        self.processor = EMGProcessor(csv_path=f'egw1_{name}.csv', fs=sample_rate)
+        self.first_packet_time = None
+        self.epochs_sent = 0
+
+    def push(self, sender, data):
+        if self.first_packet_time is None:
+            self.first_packet_time = time.time()
+        self.packet_queue.push(sender, data)
+
+    async def connect(self):
+        await self.client.connect()
+        print(f"[{self.name}] Connected to device with MAC address: {self.client.address}")
+        self.processor.preload_filters()
+        await self.client.start_notify(filtered_characteristic_uuid, self.push)
+
+    def features_calculation(self):
+        self.processor.features_calculation()
+        # Forward every epoch that was completed since the last call
+        timeline = self.processor.timeline
+        for record in timeline.records()[self.epochs_sent:]:
+            self.output.put_nowait({
+                'device': self.name,
+                'epoch': self.epochs_sent,
+                'start_sample': int(record['start_sample']),
+                'sample_time': self.first_packet_time + record['start_sample'] / self.sample_rate,
+                'time': record['time'],
+                'first_packet_time': self.first_packet_time,
+                'rms': record['rms'],
+                'iemg': record['iemg'],
+                'mnf': record['mnf'],
+                'mpf': record['mpf'],
+            })
+            self.epochs_sent += 1
+
+    async def run(self):
+        await asyncio.gather(decode_stage(self.packet_queue, self.processor.update_received_data, self.data_ready),
+                             feature_stage(self.features_calculation, self.data_ready))
+
+    # save_csv=False for a session that never started streaming
+    async def disconnect(self, save_csv=True):
+        if self.client.is_connected:
+            await self.client.disconnect()
+        if save_csv:
+            self.processor.save_csv()
+        self.processor.close()
+
+
+# Connects to several peripherals concurrently and runs one pipeline per device on the same
+# event loop. All epochs end up in one output queue (see DeviceSession for the record layout).
+class SessionManager:
+    def __init__(self, devices, queue_size=256):
+        self.output = asyncio.Queue()
+        self.sessions = [DeviceSession(name, address, self.output, queue_size=queue_size) for name, address in devices.items()]
+
+    async def connect(self):
+        results = await asyncio.gather(*(session.connect() for session in self.sessions), return_exceptions=True)
+        connected = []
+        failed = []
+        for session, result in zip(self.sessions, results):
+            if isinstance(result, Exception):
+                print(f"[{session.name}] Could not connect to {session.address}: {result}")
+                failed.append(session)
+            else:
+                connected.append(session)
+        # A device that failed after connecting (e.g. in start_notify) must not be left connected
+        await asyncio.gather(*(session.disconnect(save_csv=False) for session in failed), return_exceptions=True)
+        self.sessions = connected
+        return connected
+
+    async def records(self):
+        while True:
+            yield await self.output.get()
+
+    def stats(self):
+        return {session.name: session.packet_queue.stats() for session in self.sessions}
+
+    async def run(self, on_record):
+        async def forward_records():
+            async for record in self.records():
+                on_record(record)
+
+        await asyncio.gather(forward_records(), *(session.run() for session in self.sessions))
+
+    async def disconnect(self):
+        await asyncio.gather(*(session.disconnect() for session in self.sessions), return_exceptions=True)
+
+
+def print_record(record):
+    print(f"[{record['device']}] epoch {record['epoch']}: RMS {record['rms']:.2f}, IEMG {record['iemg']:.1f}, "
+          f"MNF {record['mnf']:.1f} Hz, MPF {record['mpf']:.1f} Hz")
+
+async def main(devices):
+    manager = SessionManager(devices)
+    try:
+        if not await manager.connect():
+            print("No device connected.")
+            return
+        await manager.run(print_record)
+    finally:
+        for name, stats in manager.stats().items():
+            print(f"[{name}] Packets received: {stats['received_packets']}, dropped: {stats['dropped_packets']}, "
+                  f"high-water mark: {stats['high_water_mark']}")
+        await manager.disconnect()
+
+
+if __name__ == '__main__':
+    devices = {
+        'bioamp': 'f4:12:fa:63:47:29',   # BioAmp EXG Pill
+        'myoware': 'f4:12:fa:63:c2:2d',  # Myoware 2.0
+    }
+    try:
+        asyncio.run(main(devices))
+    except KeyboardInterrupt:
+        print('\n\n *** Interrupted.\n')
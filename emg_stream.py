@@ -0,0 +1,292 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+# The firmware packs little-endian float32 samples back to back (59 per 236-byte packet)
+sample_dtype = np.dtype('<f4')
+# Sample rate of the stream, the one place it is set: processing (EMGProcessor fs), replay pacing,
+# record timestamps and the recording header all use it. The firmware band-pass and the algorithm B
+# bands (up to 350 Hz) are designed for 800 Hz; thesis_BioAmp.ino's SAMPLE_RATE define still says 200.
+sample_rate = 800
+filtered_characteristic_uuid = "a3b1a544-8794-11ee-b9d1-0242ac120002"
+
+class NotificationDecoder:
+    def __init__(self, dtype=sample_dtype):
+        self.dtype = np.dtype(dtype)
+        self.item_size = self.dtype.itemsize
+        self.remainder = b''
+        self.packet_count = 0
+        self.byte_count = 0
+
+    def decode(self, data):
+        self.packet_count += 1
+        self.byte_count += len(data)
+
+        # Only copy when a partial float is left over from the previous notification
+        if self.remainder:
+            buffer = self.remainder + bytes(data)
+        else:
+            buffer = data
+
+        num_samples = len(buffer) // self.item_size
+        aligned_bytes = num_samples * self.item_size
+        self.remainder = bytes(buffer[aligned_bytes:])
+
+        # View over the notification bytes, no per-sample Python objects
+        return np.frombuffer(buffer, dtype=self.dtype, count=num_samples)
+
+    def reset(self):
+        self.remainder = b''
+        self.packet_count = 0
+        self.byte_count = 0
+
+# Fixed-capacity history that keeps the most recent samples. Every sample is written twice
+# (at i and i + capacity) so the last N samples are always one contiguous slice and can be
+# handed out as a view instead of a copy. The write position is always total % capacity, and
+# total is only advanced once the new values are in place. With a shape, every value is an array
+# of that shape (e.g. one spectrogram column) and blocks are stacked along the first axis.
+class RingBuffer:
+    def __init__(self, capacity, dtype=np.float32, shape=()):
+        self.capacity = int(capacity)
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.storage = np.zeros((2 * self.capacity,) + self.shape, dtype=self.dtype)
+        self.total = 0
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append(self, value):
+        write_index = self.total % self.capacity
+        self.storage[write_index] = value
+        self.storage[write_index + self.capacity] = value
+        self.total += 1
+
+    def extend(self, block):
+        block = np.asarray(block, dtype=self.dtype)
+        num_new = len(block)
+        if num_new == 0:
+            return
+        if num_new > self.capacity:
+            # Only the tail of a very large block survives
+            block = block[-self.capacity:]
+        write_index = (self.total + num_new - len(block)) % self.capacity
+
+        first = min(len(block), self.capacity - write_index)
+        self.storage[write_index:write_index + first] = block[:first]
+        self.storage[write_index + self.capacity:write_index + self.capacity + first] = block[:first]
+        if first < len(block):
+            rest = len(block) - first
+            self.storage[:rest] = block[first:]
+            self.storage[self.capacity:self.capacity + rest] = block[first:]
+        self.total += num_new
+
+    def latest(self, n):
+        n = min(n, len(self))
+        end = self.total % self.capacity + self.capacity
+        return self.storage[end - n:end]
+
+    def values(self):
+        return self.latest(len(self))
+
+    # Absolute sample index of the oldest value still held
+    def first_index(self):
+        return self.total - len(self)
+
+    # (absolute index of the first value, last n values or all retained) for readers such as the plot window
+    def snapshot(self, n=None):
+        values = self.values() if n is None else self.latest(n)
+        return self.total - len(values), values
+
+    # Slice by absolute sample index (like list slicing, stop is clamped to what has arrived)
+    def window(self, start, stop):
+        stop = min(stop, self.total)
+        if start < self.first_index():
+            raise IndexError(f"samples before {self.first_index()} have been overwritten")
+        if stop <= start:
+            return self.storage[:0]
+        end = self.total % self.capacity + self.capacity - (self.total - stop)
+        return self.storage[end - (stop - start):end]
+
+    def at(self, index):
+        return self.window(index, index + 1)[0]
+
+    def clear(self):
+        self.total = 0
+
+
+# RingBuffer whose storage and sample count live in a multiprocessing.shared_memory block, so
+# another process (the plot window) can read the history without any copying on the writer side.
+# Layout: two int64, total and the total the write in progress will reach (equal when idle),
+# followed by the 2 * capacity values.
+class SharedRingBuffer(RingBuffer):
+    header_size = 16
+
+    def __init__(self, capacity, dtype=np.float32, name=None, shape=()):
+        self.capacity = int(capacity)
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.owner = name is None
+        size = self.header_size + 2 * self.capacity * int(np.prod(self.shape)) * self.dtype.itemsize
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = attach_shared_memory(name)
+        self.header = np.ndarray((2,), dtype=np.int64, buffer=self.shm.buf)
+        self.storage = np.ndarray((2 * self.capacity,) + self.shape, dtype=self.dtype, buffer=self.shm.buf, offset=self.header_size)
+        if self.owner:
+            self.header[:] = 0
+            self.storage[:] = 0
+
+    @property
+    def total(self):
+        return int(self.header[0])
+
+    @total.setter
+    def total(self, value):
+        self.header[0] = value
+
+    # The end of every write is announced before any value is written, so readers can tell which
+    # slots are being overwritten even before total moves
+    def append(self, value):
+        self.header[1] = self.total + 1
+        super().append(value)
+
+    def extend(self, block):
+        block = np.asarray(block, dtype=self.dtype)
+        self.header[1] = self.total + len(block)
+        super().extend(block)
+
+    def clear(self):
+        self.header[:] = 0
+
+    # Everything another process needs to attach to this buffer (picklable)
+    def spec(self):
+        return self.shm.name, self.capacity, self.dtype.str, self.shape
+
+    @classmethod
+    def attach(cls, spec):
+        name, capacity, dtype, shape = spec
+        return cls(capacity, dtype=dtype, name=name, shape=shape)
+
+    # Copy of the retained (or last n) values; retried if a write that started before the copy was
+    # done (finished or still in progress) reached into them
+    def snapshot(self, n=None):
+        while True:
+            total = self.total
+            num_values = min(total, self.capacity if n is None else n, self.capacity)
+            end = total % self.capacity + self.capacity
+            values = self.storage[end - num_values:end].copy()
+            if int(self.header[1]) - total <= self.capacity - num_values:
+                return total - num_values, values
+
+    def close(self):
+        # The array views must go before the mapping can be closed
+        self.header = None
+        self.storage = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def attach_shared_memory(name):
+    try:
+        # Python 3.13+: the reader must not register the block with the resource tracker
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Older versions: the plotting process shares the parent's tracker, so the block is
+        # still unlinked exactly once, by the owner
+        return shared_memory.SharedMemory(name=name)
+
+
+# Moving-average envelope of |x| over buffer_size samples, computed for a whole decoded block
+# at once. The last buffer_size rectified samples and the running sum are carried between
+# blocks, and the running sum is accumulated in the same order as the per-sample version
+# (subtract the oldest sample, add the newest) so the values are identical to it.
+class BlockEnvelope:
+    def __init__(self, buffer_size=208):
+        self.buffer_size = buffer_size
+        self.tail = np.zeros(buffer_size)
+        self.sum_buffer = 0.0
+
+    def process(self, block):
+        abs_block = np.abs(np.asarray(block, dtype=np.float64))
+        num_samples = len(abs_block)
+        if num_samples == 0:
+            return np.empty(0)
+
+        # Sample i replaces the value seen buffer_size samples earlier
+        history = np.concatenate((self.tail, abs_block))
+        steps = np.empty(2 * num_samples + 1)
+        steps[0] = self.sum_buffer
+        steps[1::2] = -history[:num_samples]
+        steps[2::2] = abs_block
+        running_sum = np.add.accumulate(steps)[2::2]
+
+        self.sum_buffer = running_sum[-1]
+        self.tail = history[-self.buffer_size:]
+        return (running_sum / self.buffer_size) * 2
+
+    def reset(self):
+        self.tail = np.zeros(self.buffer_size)
+        self.sum_buffer = 0.0
+
+
+# Running sum of squares and sum of absolute values over the last `window` samples. Every new
+# sample adds its terms and subtracts those of the sample leaving the window, so a block costs
+# O(len(block)) however long the window is. process() returns the per-sample RMS and IEMG traces;
+# until the window has filled, RMS is taken over the samples seen so far. The running sums are
+# re-computed from the window every resync_interval samples so rounding errors cannot build up.
+class SlidingWindowSums:
+    def __init__(self, window=800, resync_interval=8000):
+        self.window = window
+        self.resync_interval = resync_interval
+        self.reset()
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        num_samples = len(block)
+        if num_samples == 0:
+            return np.empty(0), np.empty(0)
+
+        # Sample i replaces the one seen `window` samples earlier (zero before the window has filled)
+        in_window = self.samples.latest(self.window)
+        if num_samples <= self.window:
+            leaving = in_window[:num_samples]
+        else:
+            leaving = np.concatenate((in_window, block[:num_samples - self.window]))
+        sum_squares = self.sum_squares + np.cumsum(np.square(block) - np.square(leaving))
+        sum_abs = self.sum_abs + np.cumsum(np.abs(block) - np.abs(leaving))
+        # Cancellation can leave tiny negative sums where the window is all zeros
+        np.maximum(sum_squares, 0.0, out=sum_squares)
+        np.maximum(sum_abs, 0.0, out=sum_abs)
+        counts = np.minimum(np.arange(self.count + 1, self.count + num_samples + 1), self.window)
+
+        self.samples.extend(block)
+        self.count += num_samples
+        self.sum_squares = sum_squares[-1]
+        self.sum_abs = sum_abs[-1]
+        self.samples_since_resync += num_samples
+        if self.samples_since_resync >= self.resync_interval:
+            self.resync()
+        return np.sqrt(sum_squares / counts), sum_abs
+
+    # Exact sums of the current window
+    def resync(self):
+        in_window = self.samples.latest(self.window)
+        self.sum_squares = float(np.dot(in_window, in_window))
+        self.sum_abs = float(np.sum(np.abs(in_window)))
+        self.samples_since_resync = 0
+
+    def rms(self):
+        return np.sqrt(self.sum_squares / min(self.count, self.window)) if self.count else 0.0
+
+    def iemg(self):
+        return self.sum_abs
+
+    def reset(self):
+        self.samples = RingBuffer(self.window, dtype=np.float64)
+        self.samples.extend(np.zeros(self.window))
+        self.count = 0
+        self.sum_squares = 0.0
+        self.sum_abs = 0.0
+        self.samples_since_resync = 0
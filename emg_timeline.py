@@ -0,0 +1,93 @@
+import numpy as np
+
+# Columnar store of every epoch of a session: one timeline_dtype record per epoch with its start
+# sample, the wall time it was computed and every feature. Fatigue values are NaN for epochs that
+# did not produce one; mnf_slope/fatigue_slope hold the MNF trend (see EMGProcessor.slope_fatigue).
+# Storage is preallocated and doubled when full, so appending is amortized O(1); the epochs are
+# ordered by start sample (and time), so ranges are found by binary search and returned as views,
+# never copies.
+#
+# Views point into the current storage: they stay valid, but do not see later appends once the
+# storage has been reallocated.
+
+timeline_dtype = np.dtype([
+    ('start_sample', '<i8'),
+    ('time', '<f8'),
+    ('rms', '<f8'),
+    ('iemg', '<f8'),
+    ('mnf', '<f8'),
+    ('mpf', '<f8'),
+    ('fatigue_A', '<f8'),
+    ('fatigue_B', '<f8'),
+    ('mnf_slope', '<f8'),
+    ('fatigue_slope', '<f8'),
+])
+
+class FeatureTimeline:
+    def __init__(self, initial_capacity=1024, dtype=timeline_dtype):
+        self.dtype = np.dtype(dtype)
+        self.storage = np.empty(max(int(initial_capacity), 1), dtype=self.dtype)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    # Appends one epoch and returns its index; fields not given are NaN (0 for integer fields)
+    def append(self, **fields):
+        if self.count == len(self.storage):
+            self.grow(2 * len(self.storage))
+        record = self.storage[self.count]
+        for name in self.dtype.names:
+            record[name] = fields.get(name, np.nan if self.dtype[name].kind == 'f' else 0)
+        self.count += 1
+        return self.count - 1
+
+    # Appends one epoch per element of the given columns (equal lengths; scalars are broadcast)
+    def extend(self, **columns):
+        num_records = max((np.size(values) for values in columns.values()), default=0)
+        if self.count + num_records > len(self.storage):
+            self.grow(max(2 * len(self.storage), self.count + num_records))
+        records = self.storage[self.count:self.count + num_records]
+        for name in self.dtype.names:
+            records[name] = columns.get(name, np.nan if self.dtype[name].kind == 'f' else 0)
+        self.count += num_records
+
+    def grow(self, capacity):
+        storage = np.empty(capacity, dtype=self.dtype)
+        storage[:self.count] = self.storage[:self.count]
+        self.storage = storage
+
+    def set(self, index, name, value):
+        self.storage[index][name] = value
+
+    # Every epoch so far
+    def records(self):
+        return self.storage[:self.count]
+
+    def column(self, name):
+        return self.storage[name][:self.count]
+
+    def latest(self, n):
+        return self.storage[max(self.count - n, 0):self.count]
+
+    # Values of a column that are set (not NaN), in epoch order, e.g. the fatigue series
+    def series(self, name):
+        values = self.column(name)
+        return values[~np.isnan(values)]
+
+    # Epochs with start_sample in [start, stop)
+    def sample_range(self, start, stop):
+        return self.field_range('start_sample', start, stop)
+
+    # Epochs computed in the wall-time interval [start, stop)
+    def time_range(self, start, stop):
+        return self.field_range('time', start, stop)
+
+    def field_range(self, name, start, stop):
+        values = self.column(name)
+        first = np.searchsorted(values, start, side='left')
+        last = np.searchsorted(values, stop, side='left')
+        return self.storage[first:max(first, last)]
+
+    def clear(self):
+        self.count = 0
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from emg_features import batch_epoch_features
+from emg_processor import EMGProcessor
+
+
+def stalled_processor(block_sizes, history_size=3000, seed=0):
+    signal = (np.random.default_rng(seed).standard_normal(sum(block_sizes)) * 50).astype('<f4')
+    processor = EMGProcessor(history_size=history_size, feature_levels=((800, 400), (800, 200)),
+                             fatigue_B_method='spectrum')
+    start = 0
+    for size in block_sizes:
+        processor.update_received_data(signal[start:start + size].tobytes())
+        processor.features_calculation()
+        start += size
+    return processor, signal
+
+
+# A block almost as long as the history overwrites the start of the next pending epoch while the
+# prefix sums are still inside the retained window
+def test_partial_stall_skips_overwritten_epochs():
+    processor, signal = stalled_processor([1000, 2900, 1200])
+    # After the second block the ring starts at sample 900: epochs before it are skipped, the rest
+    # continue on each level's grid
+    expected_starts = {(800, 400): [0, 1200, 1600, 2000, 2400, 2800, 3200, 3600, 4000],
+                       (800, 200): [0, 200] + list(range(1000, 4400, 200))}
+    for level in processor.pyramid.levels:
+        window, step = level
+        timeline = processor.pyramid.timelines[level]
+        reference = batch_epoch_features(signal, epoch_length=window, step=step)
+        rows = np.asarray(expected_starts[level]) // step
+        np.testing.assert_array_equal(timeline.column('start_sample'), expected_starts[level])
+        np.testing.assert_array_equal(timeline.column('mnf'), reference['mnf'][rows])
+        np.testing.assert_allclose(timeline.column('rms'), reference['rms'][rows], rtol=1e-9)
+    assert processor.skipped_epochs > 0
+
+
+def test_pyramid_without_stalls_matches_batch_features():
+    processor, signal = stalled_processor([236] * 40, history_size=48000)
+    for window, step in processor.pyramid.levels:
+        reference = batch_epoch_features(signal, epoch_length=window, step=step)
+        timeline = processor.pyramid.timelines[(window, step)]
+        np.testing.assert_array_equal(timeline.column('start_sample'), reference['start_sample'])
+        np.testing.assert_array_equal(timeline.column('mnf'), reference['mnf'])
+        np.testing.assert_allclose(timeline.column('iemg'), reference['iemg'], rtol=1e-9)
+
+
+def test_level_longer_than_history_is_rejected():
+    with pytest.raises(ValueError):
+        EMGProcessor(history_size=2000, feature_levels=((3000, 500),))
@@ -1,8 +1,14 @@
 import asyncio
+import os
+import sys
 from bleak import BleakClient
 import struct
 import matplotlib.pyplot as plt
 
+# The shared emg_* modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from emg_logging import BackgroundWriter
+
 device_address = 'F4:12:FA:63:47:29'
 raw_characteristic_uuid = "b817f6da-8796-11ee-b9d1-0242ac120002"
 filtered_characteristic_uuid = "a3b1a544-8794-11ee-b9d1-0242ac120002"
@@ -19,13 +25,13 @@ def process_packets():
         received_data = received_data[208:]  # Remove processed packet from received_data
         floats = [struct.unpack('f', packet[i:i+4])[0] for i in range(0, 208, 4)]  # Translate bytearray to floats
 
-        # Write the floats to a text file
-        with open("received_floats.txt", "a") as file:
-            file.write(', '.join(map(str, floats)) + '\n')
+        # Queue the floats for the background writer, it appends them to received_floats.txt in batches
+        float_log.write(floats)
 
 async def main():
-    global received_data
+    global received_data, float_log
     received_data = bytearray()
+    float_log = BackgroundWriter("received_floats.txt", fmt='text')
 
     async with BleakClient(device_address) as client:
         try:
@@ -44,5 +50,10 @@ async def main():
                     process_packets()
         except Exception as e:
             print(f"Error: {e}")
+        finally:
+            float_log.close()
+            stats = float_log.stats()
+            print(f"Logged {stats['bytes_written']} bytes ({stats['bytes_per_sec']:.0f} bytes/s) in {stats['flushes']} flushes, "
+                  f"flush latency mean {stats['mean_flush_latency']:.3f} s, max {stats['max_flush_latency']:.3f} s")
 
 asyncio.run(main())